@@ -1,3 +1,5 @@
+from sqlalchemy import bindparam, exists, inspect, select, text, update
+from sqlalchemy.schema import CreateIndex
 from sqlmodel import create_engine, Session
 from typing import Generator
 import os
@@ -17,9 +19,17 @@ if "sqlite" in DATABASE_URL:
 engine = create_engine(
     DATABASE_URL,
     echo=False,  # Alterar para True para debug SQL
+    query_cache_size=1200,  # SQL compilado reaproveitado entre requisições (autocomplete etc.)
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
+# Índices adicionados depois que a tabela já existia em produção,
+# com o dialeto exigido (None = qualquer banco)
+INDICES_MIGRADOS = {
+    "ix_destino_uf_cidade_lower": None,
+    "ix_cid_nome": "sqlite",
+}
+
 
 def get_session() -> Generator[Session, None, None]:
     """Dependência para obter sessão do banco de dados"""
@@ -36,4 +46,56 @@ def create_db_and_tables():
         TaxaEspecial, CEPEspecial, TabelaTarifaCompleta,
         HistoricoImportacao
     )
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
+
+    # create_all pula tabelas existentes; migrar colunas novas antes dos índices.
+    # Uma falha (ex.: dois workers disputando o ALTER) não impede a inicialização
+    try:
+        with engine.begin() as conn:
+            migrate_nome_norm(conn)
+    except Exception as e:
+        print(f"Warning: could not migrate nome_norm: {e}")
+
+    # create_all pula tabelas existentes; garantir índices novos em bancos antigos.
+    # Cada índice em sua transação: uma falha não impede a inicialização
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in INDICES_MIGRADOS:
+                continue
+            dialeto = INDICES_MIGRADOS[index.name]
+            if dialeto is not None and dialeto != engine.dialect.name:
+                continue
+            try:
+                with engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            except Exception as e:
+                print(f"Warning: could not create index {index.name}: {e}")
+
+
+def migrate_nome_norm(conn) -> int:
+    """Adiciona e preenche cidades_rodonaves.nome_norm em bancos criados sem a coluna"""
+    from .models_extended import CidadeRodonaves, normalizar_nome
+    tabela = CidadeRodonaves.__table__
+
+    colunas = {coluna['name'] for coluna in inspect(conn).get_columns(tabela.name)}
+    if 'nome_norm' in colunas:
+        # Caso comum após a primeira execução: nada a preencher, sair sem ler linhas
+        if not conn.execute(select(exists().where(tabela.c.nome_norm.is_(None)))).scalar():
+            return 0
+    else:
+        conn.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN nome_norm VARCHAR"))
+        for index in tabela.indexes:
+            if 'nome_norm' in index.columns:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+    pendentes = conn.execute(
+        select(tabela.c.id, tabela.c.nome).where(tabela.c.nome_norm.is_(None))
+    ).all()
+    if pendentes:
+        conn.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam('b_id'))
+            .values(nome_norm=bindparam('b_nome_norm')),
+            [{'b_id': id_, 'b_nome_norm': normalizar_nome(nome)} for id_, nome in pendentes]
+        )
+    return len(pendentes)
@@ -1,5 +1,6 @@
 from typing import Optional
 from datetime import datetime
+from sqlalchemy import Index, func
 from sqlmodel import SQLModel, Field, Relationship
 
 class Produto(SQLModel, table=True):
@@ -42,6 +43,15 @@ class Destino(SQLModel, table=True):
     cidade: str
     categoria: str
 
+# Autocomplete: uf exato + prefixo de lower(cidade); text_pattern_ops deixa o
+# Postgres usar o índice em LIKE 'abc%' mesmo fora da collation C
+Index(
+    "ix_destino_uf_cidade_lower",
+    Destino.uf,
+    func.lower(Destino.cidade).label("cidade_lower"),
+    postgresql_ops={"cidade_lower": "text_pattern_ops"},
+)
+
 class TarifaPeso(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     versao_id: int = Field(foreign_key="versaotabela.id")
@@ -3,9 +3,16 @@ Modelos estendidos para suportar cobertura completa de cidades Rodonaves
 Baseado nos arquivos Excel oficiais da Rodonaves com 4,219 cidades
 """
 
+from sqlalchemy import Index, collate, event
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime
+import unicodedata
+
+
+def normalizar_nome(nome: str) -> str:
+    """Forma canônica de um nome (sem acentos, maiúsculas) usada nas comparações"""
+    return unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode().upper()
 
 
 class Estado(SQLModel, table=True):
@@ -48,6 +55,7 @@ class CidadeRodonaves(SQLModel, table=True):
 
     # Identificação
     nome: str = Field(index=True)
+    nome_norm: Optional[str] = Field(default=None, index=True)  # normalizar_nome(nome), ver _preencher_nome_norm
     estado_id: int = Field(foreign_key="estados.id")
     filial_atendimento_id: int = Field(foreign_key="filiais_rodonaves.id")
 
@@ -83,6 +91,17 @@ class CidadeRodonaves(SQLModel, table=True):
     ceps_especiais: List["CEPEspecial"] = Relationship(back_populates="cidade")
 
 
+@event.listens_for(CidadeRodonaves, "before_insert")
+@event.listens_for(CidadeRodonaves, "before_update")
+def _preencher_nome_norm(mapper, connection, cidade):
+    """Mantém nome_norm em dia em toda gravação pelo ORM, em qualquer script de importação"""
+    cidade.nome_norm = normalizar_nome(cidade.nome)
+
+
+# Busca por nome sem distinção de maiúsculas (verify_direct); NOCASE só existe no SQLite
+Index("ix_cid_nome", collate(CidadeRodonaves.nome, "NOCASE")).ddl_if(dialect="sqlite")
+
+
 class TaxaEspecial(SQLModel, table=True):
     """Taxas especiais (TDA/TRT) aplicadas a cidades específicas"""
     __tablename__ = "taxas_especiais"
@@ -150,6 +169,10 @@ class CEPEspecial(SQLModel, table=True):
 class TabelaTarifaCompleta(SQLModel, table=True):
     """Tabela de tarifas por categoria com todas as faixas de peso"""
     __tablename__ = "tabelas_tarifa_completa"
+    __table_args__ = (
+        # Uma tarifa por categoria em cada versão (alvo do upsert da importação)
+        Index("uq_tarifa_ver_cat", "versao_id", "categoria_completa", unique=True),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     versao_id: int = Field(foreign_key="versaotabela.id", index=True)
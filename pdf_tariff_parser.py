@@ -4,7 +4,7 @@ Enhanced PDF Parser for Rodonaves Tariff Data
 Handles complex hierarchical structure: Region → UF → Category → Weight Ranges
 """
 
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, Iterator, List, Tuple, Optional, Any
 import pdfplumber
 import re
 import pandas as pd
@@ -42,9 +42,24 @@ class PDFTariffParser:
                 'general_params': {...}
             }
         """
-        result = {
-            'states': {},
-            'general_params': {},
+        result = self.parse_header(pdf_path)
+        result['states'] = {}
+
+        for state_code, state_data in self.iter_states(pdf_path, result['import_info']):
+            self._merge_page_data(result, {'states': {state_code: state_data}})
+
+        return result
+
+    def parse_header(self, pdf_path: str) -> Dict[str, Any]:
+        """
+        Extract the document-level data that does not depend on the tariff tables
+
+        Returns:
+            Dict with 'general_params' and an 'import_info' dict whose counters
+            are filled in by iter_states()
+        """
+        return {
+            'general_params': self._extract_general_parameters(pdf_path),
             'import_info': {
                 'pdf_path': pdf_path,
                 'pages_processed': 0,
@@ -53,33 +68,45 @@ class PDFTariffParser:
             }
         }
 
+    def iter_states(self, pdf_path: str,
+                    import_info: Optional[Dict[str, Any]] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream tariff data page by page as (state_code, state_data) tuples
+
+        A state whose categories span several pages is yielded once per page,
+        so only one page worth of tables is held in memory at a time.
+        Page counters and errors are accumulated into import_info.
+        """
+        if import_info is None:
+            import_info = self.parse_header(pdf_path)['import_info']
+        categories_seen = set()
+
         try:
             with pdfplumber.open(pdf_path) as pdf:
                 for page_num, page in enumerate(pdf.pages, 1):
                     try:
                         page_data = self._parse_page(page, page_num)
-                        if page_data:
-                            self._merge_page_data(result, page_data)
-                            result['import_info']['pages_processed'] += 1
                     except Exception as e:
                         error_msg = f"Error on page {page_num}: {str(e)}"
-                        result['import_info']['errors'].append(error_msg)
+                        import_info['errors'].append(error_msg)
                         print(f"WARNING: {error_msg}")
+                        continue
 
-            # Extract general parameters
-            result['general_params'] = self._extract_general_parameters(pdf_path)
+                    if not page_data:
+                        continue
 
-            # Count categories found
-            result['import_info']['categories_found'] = sum(
-                len(state['categories']) for state in result['states'].values()
-            )
+                    import_info['pages_processed'] += 1
+                    for state_code, state_data in page_data['states'].items():
+                        categories_seen.update(
+                            (state_code, category) for category in state_data['categories']
+                        )
+                        import_info['categories_found'] = len(categories_seen)
+                        yield state_code, state_data
 
         except Exception as e:
-            result['import_info']['errors'].append(f"Critical error: {str(e)}")
+            import_info['errors'].append(f"Critical error: {str(e)}")
             print(f"ERROR: Critical parsing error: {e}")
 
-        return result
-
     def _parse_page(self, page, page_num: int) -> Optional[Dict]:
         """Parse a single page and extract tariff data"""
         text = page.extract_text() or ""
@@ -4,36 +4,153 @@ Update City Categories Using Filial Codes
 Replace hardcoded city categorization with official filial code mapping
 """
 
+import os
+import re
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 
 # Add project root to path
 sys.path.append(str(Path(__file__).parent))
 
+from sqlalchemy import literal
 from sqlmodel import Session, select
-from frete_app.db import engine, create_db_and_tables
+from frete_app.db import engine, create_db_and_tables, migrate_nome_norm
 from frete_app.models_extended import (
-    CidadeRodonaves, FilialRodonaves, Estado, HistoricoImportacao
+    CidadeRodonaves, FilialRodonaves, Estado, HistoricoImportacao, normalizar_nome
 )
 from state_config import StateConfigManager
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Resolved once at import: whether the model exposes the category column
+HAS_CATEGORIA = hasattr(CidadeRodonaves, 'categoria_tarifa')
+
+# Capital city detection (the state sigla itself is also an indicator)
+CAPITAL_INDICATORS = ['CAPITAL', 'METROPOLE']
+
+# Known capital cities
+KNOWN_CAPITALS = {
+    'SC': ['FLORIANOPOLIS'],
+    'RS': ['PORTO ALEGRE'],
+    'PR': ['CURITIBA'],
+    'SP': ['SAO PAULO'],
+    'MG': ['BELO HORIZONTE'],
+    'GO': ['GOIANIA'],
+    'AC': ['RIO BRANCO'],
+    'AM': ['MANAUS'],
+    'AP': ['MACAPA'],
+    'PA': ['BELEM'],
+    'RO': ['PORTO VELHO'],
+    'RR': ['BOA VISTA'],
+    'TO': ['PALMAS']
+}
+
+# Population-based indicators (common large cities)
+MAJOR_CITIES = {
+    'SC': ['JOINVILLE', 'BLUMENAU', 'SAO JOSE', 'CHAPECO', 'ITAJAI', 'CRICIUMA'],
+    'RS': ['CAXIAS DO SUL', 'PELOTAS', 'CANOAS', 'SANTA MARIA', 'GRAVATAI'],
+    'PR': ['LONDRINA', 'MARINGA', 'PONTA GROSSA', 'CASCAVEL', 'SAO JOSE DOS PINHAIS'],
+    'SP': ['GUARULHOS', 'CAMPINAS', 'SAO BERNARDO DO CAMPO', 'SANTO ANDRE', 'OSASCO'],
+    'MG': ['UBERLANDIA', 'CONTAGEM', 'JUIZ DE FORA', 'BETIM', 'MONTES CLAROS']
+}
+
+# Exact (state, city) lookups for names listed in the tables above
+KNOWN_CAPITAL_NAMES = frozenset(
+    (sigla, nome) for sigla, nomes in KNOWN_CAPITALS.items() for nome in nomes
+)
+MAJOR_CITY_NAMES = frozenset(
+    (sigla, nome) for sigla, nomes in MAJOR_CITIES.items() for nome in nomes
+)
+
+# Major city detection for Interior 1
+MAJOR_CITY_INDICATORS = ['GRANDE', 'SAO', 'SANTO', 'SANTA']
+
+DEFAULT_CATEGORIES = ('INTERIOR_2',)
+
+# Below this many rows the classification runs in-process
+PARALLEL_MIN_ROWS = 5000
+CLASSIFY_CHUNK_SIZE = 1000
+
 
 class CityCategorizationUpdater:
     """
     Update city categories based on official filial code mappings
     """
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False, workers: Optional[int] = None):
         self.config_manager = StateConfigManager()
+        self.verbose = verbose
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
         self.stats = {
             'cities_processed': 0,
             'categories_changed': 0,
             'new_categorizations': 0,
             'errors': 0,
-            'warnings': []
+            'warnings': deque(maxlen=100)
         }
+        # (category, error) per city id, so step 3 does not classify again
+        self.classified_by_id: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.state_categories = self.config_manager.get_all_state_categories()
+        self.city_patterns = self.build_city_patterns()
+        self.city_automata = self.build_city_automata() if ahocorasick else {}
+        self.city_regexes = {} if ahocorasick else self.build_city_regexes()
+
+    def build_city_patterns(self) -> Dict[str, Dict[str, List[str]]]:
+        """Group the name patterns of each state by the bucket they signal"""
+        patterns = {}
+        for estado_sigla in self.state_categories:
+            patterns[estado_sigla] = {
+                'CAPITAL': KNOWN_CAPITALS.get(estado_sigla, []) + [estado_sigla] + CAPITAL_INDICATORS,
+                'MAJOR': MAJOR_CITIES.get(estado_sigla, []),
+                'INDICATOR': MAJOR_CITY_INDICATORS
+            }
+        return patterns
+
+    def build_city_automata(self) -> Dict[str, Any]:
+        """Build one Aho-Corasick automaton per state over all its name patterns"""
+        automata = {}
+        for estado_sigla, buckets in self.city_patterns.items():
+            automaton = ahocorasick.Automaton()
+            for bucket, patterns in buckets.items():
+                for pattern in patterns:
+                    # A pattern may belong to more than one bucket
+                    found = automaton.get(pattern, set())
+                    found.add(bucket)
+                    automaton.add_word(pattern, found)
+            automaton.make_automaton()
+            automata[estado_sigla] = automaton
+        return automata
+
+    def build_city_regexes(self) -> Dict[str, Dict[str, re.Pattern]]:
+        """Compile one alternation per state and bucket (plain substring matches)"""
+        regexes = {}
+        for estado_sigla, buckets in self.city_patterns.items():
+            regexes[estado_sigla] = {
+                bucket: re.compile('|'.join(map(re.escape, patterns)))
+                for bucket, patterns in buckets.items() if patterns
+            }
+        return regexes
+
+    def match_city_buckets(self, estado_sigla: str, cidade_nome: str) -> set:
+        """Return the pattern buckets (CAPITAL, MAJOR, INDICATOR) found in a city name"""
+        automaton = self.city_automata.get(estado_sigla)
+        if automaton is not None:
+            buckets = set()
+            for _, found in automaton.iter(cidade_nome):
+                buckets |= found
+            return buckets
+
+        # Fallback when pyahocorasick is not installed
+        regexes = self.city_regexes.get(estado_sigla, {})
+        return {bucket for bucket, regex in regexes.items() if regex.search(cidade_nome)}
 
     def execute_categorization_update(self, session: Session) -> Dict[str, Any]:
         """
@@ -44,6 +161,9 @@ class CityCategorizationUpdater:
 
             # Step 1: Load existing cities and filials
             print("Step 1: Loading cities and filials...")
+            normalized = self.backfill_normalized_names(session)
+            if normalized:
+                print(f"  - Normalized {normalized} city names")
             cities = self.load_cities_with_filials(session)
             print(f"  - Loaded {len(cities)} cities with filial information")
 
@@ -84,119 +204,103 @@ class CityCategorizationUpdater:
                 'stats': self.stats
             }
 
-    def load_cities_with_filials(self, session: Session) -> List[CidadeRodonaves]:
-        """Load all cities with their filial information"""
+    def backfill_normalized_names(self, session: Session) -> int:
+        """Add and fill the nome_norm column for rows ingested without it (no-op once migrated)"""
+        normalized = migrate_nome_norm(session.connection())
+        session.commit()
+        return normalized
+
+    def load_cities_with_filials(self, session: Session) -> List[Tuple]:
+        """Load (id, nome, nome_norm, sigla, categoria) tuples for all active cities"""
+        categoria = CidadeRodonaves.categoria_tarifa if HAS_CATEGORIA else literal('INTERIOR_2')
         return session.exec(
-            select(CidadeRodonaves)
+            select(
+                CidadeRodonaves.id, CidadeRodonaves.nome, CidadeRodonaves.nome_norm,
+                Estado.sigla, categoria
+            )
             .join(Estado)
             .where(CidadeRodonaves.ativo == True)
         ).all()
 
-    def update_city_categories(self, session: Session, cities: List[CidadeRodonaves]):
-        """Update city categories based on filial code mappings"""
-
-        for city in cities:
-            self.stats['cities_processed'] += 1
+    def classify_cities(self, cities: List[Tuple]) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Classify city rows, returning one (category, error) pair per row.
+        Large inputs are split into chunks and classified in worker processes.
+        """
+        if self.workers <= 1 or len(cities) < PARALLEL_MIN_ROWS:
+            return classify_rows(self, cities)
 
-            try:
-                # Get current category
-                current_category = getattr(city, 'categoria_tarifa', 'INTERIOR_2')
+        chunks = [
+            [tuple(row) for row in cities[i:i + CLASSIFY_CHUNK_SIZE]]
+            for i in range(0, len(cities), CLASSIFY_CHUNK_SIZE)
+        ]
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_classifier) as executor:
+            return [result for part in executor.map(_classify_chunk, chunks) for result in part]
 
-                # Determine new category based on filial code
-                # For now, we'll use a simplified logic since we don't have
-                # the exact filial code for each city in the current data
-                new_category = self.determine_category_by_location(city)
+    def update_city_categories(self, session: Session, cities: List[Tuple]):
+        """Update city categories based on filial code mappings"""
+        updates = []
 
-                # Update if category changed
-                if new_category != current_category:
-                    self.update_city_category(city, new_category)
-                    self.stats['categories_changed'] += 1
+        # Determine new category based on filial code
+        # For now, we'll use a simplified logic since we don't have
+        # the exact filial code for each city in the current data
+        classified = self.classify_cities(cities)
+        self.classified_by_id.update(zip((city[0] for city in cities), classified))
 
-                # Commit every 100 cities
-                if self.stats['cities_processed'] % 100 == 0:
-                    session.commit()
-                    print(f"    Processed {self.stats['cities_processed']} cities...")
+        for (city_id, nome, _, estado_sigla, current_category), (new_category, error) in zip(cities, classified):
+            self.stats['cities_processed'] += 1
 
-            except Exception as e:
+            if error is not None:
                 self.stats['errors'] += 1
-                error_msg = f"Error processing city {city.nome}/{city.estado.sigla}: {str(e)}"
-                self.stats['warnings'].append(error_msg)
-                print(f"WARNING: {error_msg}")
+                warnings = self.stats['warnings']
+                if len(warnings) < warnings.maxlen:
+                    error_msg = f"Error processing city {nome}/{estado_sigla}: {error}"
+                    warnings.append(error_msg)
+                    print(f"WARNING: {error_msg}")
+                continue
 
-        session.commit()
+            # Update if category changed
+            if new_category != current_category:
+                self.update_city_category(updates, city_id, nome, estado_sigla, new_category, current_category)
+                self.stats['categories_changed'] += 1
+
+        self.write_city_categories(session, updates)
 
-    def determine_category_by_location(self, city: CidadeRodonaves) -> str:
+    def determine_category_by_location(self, cidade_nome: str, estado_sigla: str) -> str:
         """
         Determine category based on city characteristics and state
         This is a transitional approach until we have complete filial mappings
+
+        Args:
+            cidade_nome: Normalized (accent-free, uppercase) city name
+            estado_sigla: State code
         """
-        estado_sigla = city.estado.sigla
-        cidade_nome = city.nome.upper()
 
         # Get valid categories for the state
-        valid_categories = self.config_manager.get_all_state_categories().get(estado_sigla, ['INTERIOR_2'])
+        valid_categories = self.state_categories.get(estado_sigla, DEFAULT_CATEGORIES)
 
         # Special cases for single-category states
         if len(valid_categories) == 1:
             return valid_categories[0]
 
-        # Capital city detection (improved logic)
-        capital_indicators = [
-            estado_sigla,  # State name in city name
-            'CAPITAL',
-            'METROPOLE'
-        ]
-
-        # Known capital cities
-        known_capitals = {
-            'SC': ['FLORIANOPOLIS'],
-            'RS': ['PORTO ALEGRE'],
-            'PR': ['CURITIBA'],
-            'SP': ['SAO PAULO'],
-            'MG': ['BELO HORIZONTE'],
-            'GO': ['GOIANIA'],
-            'AC': ['RIO BRANCO'],
-            'AM': ['MANAUS'],
-            'AP': ['MACAPA'],
-            'PA': ['BELEM'],
-            'RO': ['PORTO VELHO'],
-            'RR': ['BOA VISTA'],
-            'TO': ['PALMAS']
-        }
-
-        # Check if it's a known capital
-        state_capitals = known_capitals.get(estado_sigla, [])
-        if any(capital in cidade_nome for capital in state_capitals):
+        # Exact table hits skip the pattern scan
+        if (estado_sigla, cidade_nome) in KNOWN_CAPITAL_NAMES:
             return 'CAPITAL'
+        if (estado_sigla, cidade_nome) in MAJOR_CITY_NAMES:
+            return 'INTERIOR_1' if 'INTERIOR_1' in valid_categories else 'CAPITAL'
 
-        # Check for capital indicators
-        if any(indicator in cidade_nome for indicator in capital_indicators):
-            return 'CAPITAL'
+        buckets = self.match_city_buckets(estado_sigla, cidade_nome)
 
-        # Major city detection for Interior 1
-        major_city_indicators = [
-            'GRANDE',
-            'SAO',
-            'SANTO',
-            'SANTA',
-            len(cidade_nome) < 8  # Short names often indicate major cities
-        ]
+        # Known capitals and capital indicators
+        if 'CAPITAL' in buckets:
+            return 'CAPITAL'
 
         # Population-based indicators (common large cities)
-        major_cities = {
-            'SC': ['JOINVILLE', 'BLUMENAU', 'SAO JOSE', 'CHAPECO', 'ITAJAI', 'CRICIUMA'],
-            'RS': ['CAXIAS DO SUL', 'PELOTAS', 'CANOAS', 'SANTA MARIA', 'GRAVATAÍ'],
-            'PR': ['LONDRINA', 'MARINGA', 'PONTA GROSSA', 'CASCAVEL', 'SAO JOSE DOS PINHAIS'],
-            'SP': ['GUARULHOS', 'CAMPINAS', 'SAO BERNARDO DO CAMPO', 'SANTO ANDRE', 'OSASCO'],
-            'MG': ['UBERLANDIA', 'CONTAGEM', 'JUIZ DE FORA', 'BETIM', 'MONTES CLAROS']
-        }
-
-        state_major_cities = major_cities.get(estado_sigla, [])
-        if any(major_city in cidade_nome for major_city in state_major_cities):
+        if 'MAJOR' in buckets:
             return 'INTERIOR_1' if 'INTERIOR_1' in valid_categories else 'CAPITAL'
 
         # Check for other major city indicators
-        if any(indicator for indicator in major_city_indicators if isinstance(indicator, str) and indicator in cidade_nome):
+        if 'INDICATOR' in buckets:
             return 'INTERIOR_1' if 'INTERIOR_1' in valid_categories else 'INTERIOR_2'
 
         # Default to Interior 2 or the most common category for the state
@@ -207,43 +311,55 @@ class CityCategorizationUpdater:
         else:
             return valid_categories[0] if valid_categories else 'INTERIOR_2'
 
-    def update_city_category(self, city: CidadeRodonaves, new_category: str):
-        """Update city category"""
+    def update_city_category(self, updates: List[Dict[str, Any]], city_id: int, nome: str,
+                             estado_sigla: str, new_category: str, old_category: Optional[str] = None):
+        """Queue a city category change for the bulk write"""
         # Update the category field if it exists
-        if hasattr(city, 'categoria_tarifa'):
-            old_category = city.categoria_tarifa
-            city.categoria_tarifa = new_category
-            print(f"    Updated {city.nome}/{city.estado.sigla}: {old_category} -> {new_category}")
+        if HAS_CATEGORIA:
+            updates.append({'id': city_id, 'categoria_tarifa': new_category})
+            if self.verbose:
+                print(f"    Updated {nome}/{estado_sigla}: {old_category} -> {new_category}")
         else:
             # If the field doesn't exist, we'll need to add it or handle differently
-            print(f"    Would update {city.nome}/{city.estado.sigla} to {new_category}")
+            if self.verbose:
+                print(f"    Would update {nome}/{estado_sigla} to {new_category}")
             self.stats['new_categorizations'] += 1
 
+    def write_city_categories(self, session: Session, updates: List[Dict[str, Any]]):
+        """Write queued category changes with a single bulk UPDATE by primary key"""
+        if updates:
+            session.bulk_update_mappings(CidadeRodonaves, updates)
+        session.commit()
+
     def update_unmapped_cities(self, session: Session):
         """Handle cities that don't have specific filial code mappings"""
 
         # Find cities without category assignments
-        unmapped_cities = session.exec(
-            select(CidadeRodonaves)
-            .join(Estado)
-            .where(CidadeRodonaves.ativo == True)
-            # Add condition for unmapped cities based on your schema
-        ).all()
+        # (add a condition for unmapped cities based on your schema)
+        unmapped_cities = self.load_cities_with_filials(session)
 
         print(f"  - Found {len(unmapped_cities)} cities to process")
 
-        # Apply default categorization logic for unmapped cities
-        for city in unmapped_cities:
-            try:
-                category = self.determine_category_by_location(city)
-                self.update_city_category(city, category)
-                self.stats['new_categorizations'] += 1
-            except Exception as e:
+        # Apply default categorization logic for unmapped cities, reusing the
+        # step 2 result for cities it already classified
+        pending = [city for city in unmapped_cities if city[0] not in self.classified_by_id]
+        self.classified_by_id.update(zip((city[0] for city in pending), self.classify_cities(pending)))
+        classified = [self.classified_by_id[city[0]] for city in unmapped_cities]
+
+        updates = []
+        for (city_id, nome, _, estado_sigla, current_category), (category, error) in zip(unmapped_cities, classified):
+            if error is not None:
                 self.stats['errors'] += 1
-                error_msg = f"Error categorizing {city.nome}: {str(e)}"
-                self.stats['warnings'].append(error_msg)
+                warnings = self.stats['warnings']
+                if len(warnings) < warnings.maxlen:
+                    warnings.append(f"Error categorizing {nome}: {error}")
+                continue
 
-        session.commit()
+            self.stats['new_categorizations'] += 1
+            if category != current_category:
+                self.update_city_category(updates, city_id, nome, estado_sigla, category, current_category)
+
+        self.write_city_categories(session, updates)
 
     def create_audit_trail(self, session: Session):
         """Create audit trail for the categorization update"""
@@ -256,7 +372,7 @@ class CityCategorizationUpdater:
             registros_atualizados=self.stats['categories_changed'],
             registros_erro=self.stats['errors'],
             status="SUCESSO" if self.stats['errors'] == 0 else "PARCIAL",
-            mensagem_erro="; ".join(self.stats['warnings'][:5]) if self.stats['warnings'] else None,
+            mensagem_erro="; ".join(islice(self.stats['warnings'], 5)) if self.stats['warnings'] else None,
             detalhes_importacao=f"Categories changed: {self.stats['categories_changed']}, "
                                f"New categorizations: {self.stats['new_categorizations']}"
         )
@@ -276,20 +392,17 @@ class CityCategorizationUpdater:
         }
 
         try:
-            # Count cities by state and category
-            all_cities = session.exec(
-                select(CidadeRodonaves)
-                .join(Estado)
-                .where(CidadeRodonaves.ativo == True)
-            ).all()
+            # Count cities by state and category (sigla comes from the join,
+            # no per-row city.estado traversal)
+            all_cities = self.load_cities_with_filials(session)
 
             validation_result['total_cities'] = len(all_cities)
 
             # Group by state
             state_categories = {}
-            for city in all_cities:
-                estado = city.estado.sigla
-                categoria = getattr(city, 'categoria_tarifa', 'UNKNOWN')
+            for _, _, _, estado, categoria in all_cities:
+                if not HAS_CATEGORIA:
+                    categoria = 'UNKNOWN'
 
                 if estado not in state_categories:
                     state_categories[estado] = {}
@@ -347,12 +460,39 @@ class CityCategorizationUpdater:
 
         if self.stats['warnings']:
             print(f"\nWarnings ({len(self.stats['warnings'])}):")
-            for warning in self.stats['warnings'][:5]:
+            for warning in islice(self.stats['warnings'], 5):
                 print(f"  - {warning}")
 
         print(f"\n" + "="*60)
 
 
+def classify_rows(updater: CityCategorizationUpdater, rows: List[Tuple]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Classify (id, nome, nome_norm, sigla, categoria) rows into (category, error) pairs"""
+    results = []
+    for _, nome, nome_norm, estado_sigla, _ in rows:
+        try:
+            category = updater.determine_category_by_location(
+                nome_norm or normalizar_nome(nome), estado_sigla
+            )
+            results.append((category, None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+# Per-process classifier, built once by the pool initializer
+_worker_updater: Optional[CityCategorizationUpdater] = None
+
+
+def _init_classifier():
+    global _worker_updater
+    _worker_updater = CityCategorizationUpdater(workers=1)
+
+
+def _classify_chunk(rows: List[Tuple]) -> List[Tuple[Optional[str], Optional[str]]]:
+    return classify_rows(_worker_updater, rows)
+
+
 def main():
     """Main execution function"""
 
@@ -363,7 +503,7 @@ def main():
 
         with Session(engine) as session:
             # Create updater instance
-            updater = CityCategorizationUpdater()
+            updater = CityCategorizationUpdater(verbose='--verbose' in sys.argv)
 
             # Execute categorization update
             result = updater.execute_categorization_update(session)
@@ -7,11 +7,16 @@ Imports real Rodonaves tariff data from PDF and updates database
 import sys
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterable, List, Optional, Any, Tuple
+
+import numpy as np
 
 # Add project root to path
 sys.path.append(str(Path(__file__).parent))
 
+from sqlalchemy import insert, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import Session, select
 from frete_app.db import engine, create_db_and_tables
 from frete_app.models import VersaoTabela, ParametrosGerais
@@ -21,6 +26,20 @@ from frete_app.models_extended import (
 from pdf_tariff_parser import PDFTariffParser
 from state_config import StateConfigManager
 
+WEIGHT_COLUMNS = ('ate_10', 'ate_20', 'ate_40', 'ate_60', 'ate_100', 'excedente_por_kg')
+
+# Weight ranges that must never decrease, in ascending order
+PROGRESSION_COLUMNS = WEIGHT_COLUMNS[:5]
+
+# Rows buffered before each upsert while the PDF is streamed
+TARIFF_BATCH_SIZE = 1000
+
+# Columns refreshed when a tariff record already exists for the version
+UPSERT_COLUMNS = WEIGHT_COLUMNS + (
+    'gris_percent_especial', 'fvalor_percent_especial', 'pedagio_adicional',
+    'data_atualizacao', 'importado_pdf'
+)
+
 
 class TariffDataUpdater:
     """
@@ -29,6 +48,7 @@ class TariffDataUpdater:
 
     def __init__(self, pdf_path: str):
         self.pdf_path = pdf_path
+        self._pdf_name = Path(pdf_path).name
         self.parser = PDFTariffParser()
         self.config_manager = StateConfigManager()
         self.stats = {
@@ -46,38 +66,49 @@ class TariffDataUpdater:
         try:
             print("Starting comprehensive tariff data update...")
 
-            # Step 1: Parse PDF data
-            print("Step 1: Parsing PDF tariff data...")
-            parsed_data = self.parser.parse_pdf(self.pdf_path)
-            if not parsed_data['states']:
-                raise Exception("No tariff data extracted from PDF")
-
-            print(f"  - Extracted data for {len(parsed_data['states'])} states")
-            print(f"  - Found {parsed_data['import_info']['categories_found']} categories")
-
-            # Step 2: Create new version record
-            print("Step 2: Creating new version record...")
-            version = self.create_new_version(session)
-            print(f"  - Created version ID: {version.id}")
-
-            # Step 3: Update tariff tables with real data
-            print("Step 3: Updating tariff tables...")
-            self.update_tariff_tables(session, parsed_data, version.id)
-
-            # Step 4: Update general parameters
-            print("Step 4: Updating general parameters...")
-            self.update_general_parameters(session, parsed_data, version.id)
-
-            # Step 5: Create audit trail
-            print("Step 5: Creating audit trail...")
-            self.create_audit_trail(session, version.id, parsed_data)
+            # Step 1: Read PDF header data; the tariff tables are streamed in step 3
+            print("Step 1: Reading PDF parameters...")
+            parsed_data = self.parser.parse_header(self.pdf_path)
+            states = self.parser.iter_states(self.pdf_path, parsed_data['import_info'])
+
+            # Steps 2-5 run in a single transaction committed once at the end
+            restore_durability = None
+            try:
+                with session.begin():
+                    restore_durability = self.relax_sqlite_durability(session)
+
+                    # Step 2: Create new version record
+                    print("Step 2: Creating new version record...")
+                    version = self.create_new_version(session)
+                    version_id = version.id
+                    print(f"  - Created version ID: {version_id}")
+
+                    # Step 3: Update tariff tables with real data
+                    print("Step 3: Parsing PDF tariff data and updating tariff tables...")
+                    self.update_tariff_tables(session, states, version_id)
+                    if not self.stats['states_processed']:
+                        raise Exception("No tariff data extracted from PDF")
+
+                    print(f"  - Extracted data for {self.stats['states_processed']} states")
+                    print(f"  - Found {parsed_data['import_info']['categories_found']} categories")
+
+                    # Step 4: Update general parameters
+                    print("Step 4: Updating general parameters...")
+                    self.update_general_parameters(session, parsed_data, version_id)
+
+                    # Step 5: Create audit trail
+                    print("Step 5: Creating audit trail...")
+                    self.create_audit_trail(session, version_id, parsed_data)
+            finally:
+                if restore_durability:
+                    restore_durability()
 
             # Step 6: Validate results
             print("Step 6: Validating results...")
-            validation_result = self.validate_update_results(session, version.id)
+            validation_result = self.validate_update_results(session, version_id)
 
             result = {
-                'version_id': version.id,
+                'version_id': version_id,
                 'stats': self.stats,
                 'validation': validation_result,
                 'success': True
@@ -102,66 +133,189 @@ class TariffDataUpdater:
         """Create new version record for this tariff update"""
         version = VersaoTabela(
             nome=f"PDF Import {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-            descricao=f"Real tariff data imported from {Path(self.pdf_path).name}",
+            descricao=f"Real tariff data imported from {self._pdf_name}",
             ativa=True,
             data_importacao=datetime.now()
         )
 
         # Deactivate previous versions
-        previous_versions = session.exec(
-            select(VersaoTabela).where(VersaoTabela.ativa == True)
-        ).all()
-        for prev_version in previous_versions:
-            prev_version.ativa = False
+        session.execute(
+            update(VersaoTabela).where(VersaoTabela.ativa == True).values(ativa=False)
+        )
 
         session.add(version)
-        session.commit()
+        session.flush()
         session.refresh(version)
 
         return version
 
-    def update_tariff_tables(self, session: Session, parsed_data: Dict, version_id: int):
-        """Update TabelaTarifaCompleta with real PDF data"""
+    def relax_sqlite_durability(self, session: Session) -> Optional[Callable[[], None]]:
+        """
+        Turn off fsyncs and keep the rollback journal in memory for the bulk load.
+        Returns a callable restoring the previous settings once the transaction
+        has been committed (journal_mode cannot change inside a transaction).
+        """
+        if session.get_bind().dialect.name != 'sqlite':
+            return None
+
+        dbapi_connection = session.connection().connection.dbapi_connection
+        synchronous = dbapi_connection.execute("PRAGMA synchronous").fetchone()[0]
+        journal_mode = dbapi_connection.execute("PRAGMA journal_mode").fetchone()[0]
+        dbapi_connection.execute("PRAGMA synchronous=OFF")
+        dbapi_connection.execute("PRAGMA journal_mode=MEMORY")
+
+        def restore():
+            dbapi_connection.execute(f"PRAGMA journal_mode={journal_mode}")
+            dbapi_connection.execute(f"PRAGMA synchronous={synchronous}")
+
+        return restore
 
-        for state_code, state_data in parsed_data['states'].items():
+    def update_tariff_tables(self, session: Session, states: Iterable[Tuple[str, Dict]], version_id: int):
+        """
+        Update TabelaTarifaCompleta with real PDF data
+
+        Args:
+            states: (state_code, state_data) tuples as streamed by PDFTariffParser.iter_states
+        """
+        rows = []
+        states_seen = set()
+        categories_seen = set()
+
+        # One timestamp for every record written by this update
+        self._now = datetime.now()
+
+        # Load the version's existing records once instead of one SELECT per category
+        existing_map = {
+            record.categoria_completa: record
+            for record in session.exec(
+                select(TabelaTarifaCompleta).where(
+                    TabelaTarifaCompleta.versao_id == version_id
+                )
+            ).all()
+        }
+        self.ensure_tariff_indexes(session)
+        write_batch = self.build_tariff_writer(session)
+
+        for state_code, state_data in states:
             print(f"  Processing {state_code}...")
 
+            # State parameters only depend on the state
+            state_params = self.config_manager.get_state_parameters(state_code)
+
             for category, weight_data in state_data['categories'].items():
                 categoria_completa = f"{state_code}_{category}"
 
                 # Check if record exists
-                existing = session.exec(
-                    select(TabelaTarifaCompleta).where(
-                        TabelaTarifaCompleta.versao_id == version_id,
-                        TabelaTarifaCompleta.categoria_completa == categoria_completa
-                    )
-                ).first()
+                existing = existing_map.get(categoria_completa)
 
                 if existing:
-                    # Update existing record
-                    self.update_tariff_record(existing, weight_data, state_data)
-                    self.stats['categories_updated'] += 1
-                else:
-                    # Create new record
-                    new_record = self.create_tariff_record(
-                        version_id, state_code, category, weight_data, state_data
-                    )
-                    session.add(new_record)
-                    self.stats['categories_created'] += 1
-
-            self.stats['states_processed'] += 1
-
-        session.commit()
+                    # Weight ranges missing from the PDF keep their current value
+                    weight_data = {
+                        **{column: getattr(existing, column) for column in WEIGHT_COLUMNS},
+                        **weight_data
+                    }
+
+                # A category repeated on a later page replaces the earlier values
+                if categoria_completa not in categories_seen:
+                    categories_seen.add(categoria_completa)
+                    if existing:
+                        self.stats['categories_updated'] += 1
+                    else:
+                        self.stats['categories_created'] += 1
+
+                rows.append(self.create_tariff_record(
+                    version_id, state_code, category, weight_data, state_params
+                ))
+
+            if state_code not in states_seen:
+                states_seen.add(state_code)
+                self.stats['states_processed'] += 1
+
+            # Insert new and update existing records in bounded upsert batches
+            if len(rows) >= TARIFF_BATCH_SIZE:
+                write_batch(rows)
+                rows.clear()
+
+        if rows:
+            write_batch(rows)
+
         print(f"  - Updated/created {self.stats['categories_updated'] + self.stats['categories_created']} tariff records")
 
-    def create_tariff_record(self, version_id: int, state_code: str, category: str,
-                           weight_data: Dict, state_data: Dict) -> TabelaTarifaCompleta:
-        """Create new tariff record with real PDF data"""
+    def ensure_tariff_indexes(self, session: Session):
+        """
+        The upsert conflict target needs the unique (versao_id, categoria_completa)
+        index; create it for databases built before the model declared it
+        """
+        session.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_tarifa_ver_cat "
+            f"ON {TabelaTarifaCompleta.__tablename__} (versao_id, categoria_completa)"
+        ))
+
+    def build_tariff_upsert(self, session: Session):
+        """INSERT ... ON CONFLICT (versao_id, categoria_completa) DO UPDATE for the active dialect"""
+        if session.get_bind().dialect.name == 'postgresql':
+            stmt = postgresql_insert(TabelaTarifaCompleta)
+        else:
+            stmt = sqlite_insert(TabelaTarifaCompleta)
+
+        return stmt.on_conflict_do_update(
+            index_elements=['versao_id', 'categoria_completa'],
+            set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS}
+        )
+
+    def build_tariff_writer(self, session: Session) -> Callable[[List[Dict[str, Any]]], None]:
+        """
+        Return a function that upserts a batch of tariff records in the session's transaction
+
+        On SQLite the batch goes straight to the DBAPI cursor's executemany with
+        positional parameters, skipping SQLAlchemy's per-batch statement handling;
+        other databases use the Core upsert. That one is sent as a single
+        multi-VALUES statement, which cannot update the same row twice, so the
+        batch keeps only the last record per categoria_completa first.
+        """
+        dialect = session.get_bind().dialect
+        if dialect.name != 'sqlite':
+            upsert = self.build_tariff_upsert(session)
+
+            def upsert_batch(rows: List[Dict[str, Any]]):
+                latest = {row['categoria_completa']: row for row in rows}
+                session.execute(upsert, list(latest.values()))
+
+            return upsert_batch
+
+        table = TabelaTarifaCompleta.__table__
+        cursor = session.connection().connection.cursor()
+        statement = {}
+
+        def write_batch(rows: List[Dict[str, Any]]):
+            if not statement:
+                columns = list(rows[0])
+                statement['sql'] = (
+                    f"INSERT INTO {table.name} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' for _ in columns)}) "
+                    "ON CONFLICT (versao_id, categoria_completa) DO UPDATE SET "
+                    + ", ".join(f"{column} = excluded.{column}" for column in UPSERT_COLUMNS)
+                )
+                # Store values exactly as SQLAlchemy would (e.g. datetime formatting)
+                statement['columns'] = [
+                    (column, table.c[column].type.bind_processor(dialect))
+                    for column in columns
+                ]
+
+            cursor.executemany(statement['sql'], [
+                tuple(
+                    process(row[column]) if process else row[column]
+                    for column, process in statement['columns']
+                )
+                for row in rows
+            ])
 
-        # Get state parameters
-        state_params = self.config_manager.get_state_parameters(state_code)
+        return write_batch
 
-        return TabelaTarifaCompleta(
+    def create_tariff_record(self, version_id: int, state_code: str, category: str,
+                           weight_data: Dict, state_params: Dict) -> Dict[str, Any]:
+        """Build the column values of a new tariff record with real PDF data"""
+        return dict(
             versao_id=version_id,
             estado_sigla=state_code,
             categoria=category,
@@ -181,33 +335,12 @@ class TariffDataUpdater:
             icms_percent=state_params.get('icms_percent'),
             pedagio_adicional=state_params.get('pedagio_special'),
 
-            # Metadata
-            importado_pdf=Path(self.pdf_path).name,
-            data_atualizacao=datetime.now()
+            # Metadata (bulk inserts bypass the model's default_factory)
+            importado_pdf=self._pdf_name,
+            criado_em=self._now,
+            data_atualizacao=self._now
         )
 
-    def update_tariff_record(self, record: TabelaTarifaCompleta,
-                           weight_data: Dict, state_data: Dict):
-        """Update existing tariff record with real PDF data"""
-
-        # Update weight ranges
-        record.ate_10 = weight_data.get('ate_10', record.ate_10)
-        record.ate_20 = weight_data.get('ate_20', record.ate_20)
-        record.ate_40 = weight_data.get('ate_40', record.ate_40)
-        record.ate_60 = weight_data.get('ate_60', record.ate_60)
-        record.ate_100 = weight_data.get('ate_100', record.ate_100)
-        record.excedente_por_kg = weight_data.get('excedente_por_kg', record.excedente_por_kg)
-
-        # Update state parameters
-        state_params = self.config_manager.get_state_parameters(record.estado_sigla)
-        record.gris_percent_especial = state_params.get('gris_percent')
-        record.fvalor_percent_especial = state_params.get('fvalor_percent')
-        record.pedagio_adicional = state_params.get('pedagio_special')
-
-        # Update metadata
-        record.importado_pdf = Path(self.pdf_path).name
-        record.data_atualizacao = datetime.now()
-
     def update_general_parameters(self, session: Session, parsed_data: Dict, version_id: int):
         """Update general parameters with regional variations"""
 
@@ -224,15 +357,16 @@ class TariffDataUpdater:
             # Update existing
             self.update_params_record(existing_params, general_params)
         else:
-            # Create new
-            new_params = self.create_params_record(version_id, general_params)
-            session.add(new_params)
-
-        session.commit()
+            # Create new as a single-row Core insert in the update transaction
+            session.execute(
+                insert(ParametrosGerais).values(
+                    **self.create_params_record(version_id, general_params)
+                )
+            )
 
-    def create_params_record(self, version_id: int, general_params: Dict) -> ParametrosGerais:
-        """Create new general parameters record"""
-        return ParametrosGerais(
+    def create_params_record(self, version_id: int, general_params: Dict) -> Dict[str, Any]:
+        """Build the column values of a new general parameters record"""
+        return dict(
             versao_id=version_id,
             cubagem_kg_por_m3=general_params.get('cubagem_kg_por_m3', 200.0),
             fvalor_percent_padrao=0.00316,  # Standard rate for most regions
@@ -254,9 +388,9 @@ class TariffDataUpdater:
     def create_audit_trail(self, session: Session, version_id: int, parsed_data: Dict):
         """Create comprehensive audit trail"""
 
-        historico = HistoricoImportacao(
+        session.execute(insert(HistoricoImportacao).values(
             tipo_arquivo="PDF_TARIFF_COMPLETE",
-            nome_arquivo=Path(self.pdf_path).name,
+            nome_arquivo=self._pdf_name,
             total_registros=parsed_data['import_info']['categories_found'],
             registros_importados=self.stats['categories_created'],
             registros_atualizados=self.stats['categories_updated'],
@@ -266,10 +400,7 @@ class TariffDataUpdater:
             detalhes_importacao=f"States: {self.stats['states_processed']}, "
                                f"PDF pages: {parsed_data['import_info']['pages_processed']}, "
                                f"Version: {version_id}"
-        )
-
-        session.add(historico)
-        session.commit()
+        ))
 
     def validate_update_results(self, session: Session, version_id: int) -> Dict[str, Any]:
         """Validate the updated tariff data for completeness and consistency"""
@@ -284,65 +415,59 @@ class TariffDataUpdater:
         }
 
         try:
-            # Count total records
-            total_records = session.exec(
-                select(TabelaTarifaCompleta).where(
-                    TabelaTarifaCompleta.versao_id == version_id
-                )
+            # Fetch only the columns the checks below read
+            rows = session.exec(
+                select(
+                    TabelaTarifaCompleta.categoria_completa,
+                    *(getattr(TabelaTarifaCompleta, column) for column in PROGRESSION_COLUMNS)
+                ).where(TabelaTarifaCompleta.versao_id == version_id)
             ).all()
 
-            validation_result['total_records'] = len(total_records)
+            validation_result['total_records'] = len(rows)
 
-            # Validate weight progressions
-            for record in total_records:
-                if self.validate_weight_progression(record):
-                    validation_result['valid_progressions'] += 1
-                else:
-                    validation_result['invalid_progressions'].append(
-                        f"{record.categoria_completa}"
-                    )
+            # Validate weight progressions for the whole version at once
+            valid_mask = self.validate_weight_progressions([row[1:] for row in rows])
+            validation_result['valid_progressions'] = int(valid_mask.sum())
+            validation_result['invalid_progressions'] = [
+                rows[i][0] for i in np.flatnonzero(~valid_mask)
+            ]
 
             # Check state coverage
-            expected_states = set(self.config_manager.get_all_state_categories().keys())
-            found_states = set(record.estado_sigla for record in total_records)
+            expected_states = set(self.config_manager.get_all_state_categories())
+            found_states = set(session.exec(
+                select(TabelaTarifaCompleta.estado_sigla).where(
+                    TabelaTarifaCompleta.versao_id == version_id
+                ).distinct()
+            ).all())
             validation_result['missing_states'] = list(expected_states - found_states)
 
-            # Coverage by region
-            regional_coverage = {}
-            for record in total_records:
-                region = self.config_manager.state_regional_config[record.estado_sigla]['region']
-                if region not in regional_coverage:
-                    regional_coverage[region] = []
-                regional_coverage[region].append(record.estado_sigla)
-
-            validation_result['coverage_by_region'] = {
-                region: list(set(states)) for region, states in regional_coverage.items()
+            # Coverage by region, resolving each state's region once
+            region_of = {
+                sigla: config['region']
+                for sigla, config in self.config_manager.state_regional_config.items()
             }
+            regional_coverage = {}
+            for estado_sigla in found_states:
+                regional_coverage.setdefault(region_of[estado_sigla], []).append(estado_sigla)
+
+            validation_result['coverage_by_region'] = regional_coverage
 
         except Exception as e:
             validation_result['errors'].append(f"Validation error: {str(e)}")
 
         return validation_result
 
-    def validate_weight_progression(self, record: TabelaTarifaCompleta) -> bool:
-        """Validate that weight ranges are in ascending order"""
-        try:
-            weights = [
-                record.ate_10 or 0,
-                record.ate_20 or 0,
-                record.ate_40 or 0,
-                record.ate_60 or 0,
-                record.ate_100 or 0
-            ]
-
-            # Allow some tolerance for equal values but ensure no decreases
-            for i in range(len(weights) - 1):
-                if weights[i] > weights[i + 1] and weights[i + 1] > 0:
-                    return False
+    def validate_weight_progressions(self, weight_rows: List[Tuple]) -> np.ndarray:
+        """Validate that weight ranges are in ascending order, one flag per row
 
-            return True
-        except:
-            return False
+        Missing values count as 0 and a range priced at 0 never invalidates
+        the row, so only real decreases are flagged.
+        """
+        weights = np.nan_to_num(
+            np.array(weight_rows, dtype=np.float64).reshape(-1, len(PROGRESSION_COLUMNS))
+        )
+        decreases = (weights[:, :-1] > weights[:, 1:]) & (weights[:, 1:] > 0)
+        return ~decreases.any(axis=1)
 
     def print_update_summary(self, result: Dict):
         """Print comprehensive update summary"""
@@ -399,16 +524,19 @@ def main():
                 # Show sample of updated data
                 print(f"\nSample updated records:")
                 sample_records = session.exec(
-                    select(TabelaTarifaCompleta).where(
+                    select(
+                        TabelaTarifaCompleta.categoria_completa,
+                        *(getattr(TabelaTarifaCompleta, column) for column in WEIGHT_COLUMNS)
+                    ).where(
                         TabelaTarifaCompleta.versao_id == result['version_id']
                     ).limit(5)
                 ).all()
 
-                for record in sample_records:
-                    print(f"  {record.categoria_completa}: "
-                          f"R$ {record.ate_10:.2f} - {record.ate_20:.2f} - "
-                          f"{record.ate_40:.2f} - {record.ate_60:.2f} - "
-                          f"{record.ate_100:.2f} (exc: {record.excedente_por_kg:.3f})")
+                for categoria_completa, ate_10, ate_20, ate_40, ate_60, ate_100, excedente in sample_records:
+                    print(f"  {categoria_completa}: "
+                          f"R$ {ate_10:.2f} - {ate_20:.2f} - "
+                          f"{ate_40:.2f} - {ate_60:.2f} - "
+                          f"{ate_100:.2f} (exc: {excedente:.3f})")
 
                 return 0
             else:
@@ -10,7 +10,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from frete_app.db import engine
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
 from frete_app.models import Destino
 
 def verify_cities():
@@ -19,52 +19,44 @@ def verify_cities():
 
     with Session(engine) as session:
         # Contar total
-        all_cities = session.exec(select(Destino)).all()
-        print(f"Total de cidades: {len(all_cities)}")
+        total = session.exec(select(func.count()).select_from(Destino)).one()
+        print(f"Total de cidades: {total}")
 
-        # Contar por UF
-        ufs = {}
-        for city in all_cities:
-            if city.uf in ufs:
-                ufs[city.uf] += 1
-            else:
-                ufs[city.uf] = 1
+        # Contar por UF (agregado no banco)
+        ufs = dict(session.exec(
+            select(Destino.uf, func.count()).group_by(Destino.uf)
+        ).all())
 
         print(f"\nCidades por UF (primeiras 20):")
-        count = 0
-        for uf, qty in sorted(ufs.items()):
-            if count < 20:
-                print(f"  {uf}: {qty} cidades")
-                count += 1
+        for uf, qty in sorted(ufs.items())[:20]:
+            print(f"  {uf}: {qty} cidades")
 
         # Buscar exemplos de cidades conhecidas
         print(f"\nExemplos de busca:")
         test_cities = ["SAO PAULO", "RIO DE JANEIRO", "CURITIBA", "PORTO ALEGRE"]
 
         for test_city in test_cities:
+            filtro = Destino.cidade.ilike(f"%{test_city}%")
+            total_resultados = session.exec(
+                select(func.count()).select_from(Destino).where(filtro)
+            ).one()
             results = session.exec(
-                select(Destino).where(
-                    Destino.cidade.ilike(f"%{test_city}%")
-                )
+                select(Destino).where(filtro).limit(3)  # Mostrar apenas 3 primeiros
             ).all()
-            print(f"  '{test_city}': {len(results)} resultados")
-            if results:
-                for result in results[:3]:  # Mostrar apenas 3 primeiros
-                    print(f"    - {result.cidade} ({result.uf}) - {result.categoria}")
+            print(f"  '{test_city}': {total_resultados} resultados")
+            for result in results:
+                print(f"    - {result.cidade} ({result.uf}) - {result.categoria}")
 
         # Verificar categorias
-        categorias = {}
-        for city in all_cities:
-            if city.categoria in categorias:
-                categorias[city.categoria] += 1
-            else:
-                categorias[city.categoria] = 1
+        categorias = dict(session.exec(
+            select(Destino.categoria, func.count()).group_by(Destino.categoria)
+        ).all())
 
         print(f"\nCidades por categoria:")
         for cat, qty in categorias.items():
             print(f"  {cat}: {qty} cidades")
 
-        return len(all_cities)
+        return total
 
 if __name__ == "__main__":
     total = verify_cities()
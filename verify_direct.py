@@ -6,6 +6,18 @@ Direct SQL verification script for distance data.
 import sqlite3
 import os
 
+MAJOR_CAPITALS = (
+    ('São Paulo', 'SP'),
+    ('Rio de Janeiro', 'RJ'),
+    ('Belo Horizonte', 'MG'),
+    ('Curitiba', 'PR'),
+    ('Porto Alegre', 'RS'),
+    ('Florianópolis', 'SC'),
+)
+
+# Distances above this are reported as anomalies
+HIGH_DISTANCE_KM = 2500
+
 def verify_distances():
     db_path = "frete.db"
 
@@ -20,6 +32,9 @@ def verify_distances():
     print("=" * 60)
 
     try:
+        # One read transaction so every section sees the same snapshot
+        cursor.execute("BEGIN")
+
         # 1. Basic counts
         print("\n1. DATABASE OVERVIEW")
         print("-" * 30)
@@ -41,14 +56,18 @@ def verify_distances():
         print("\n2. DISTANCE DATA STATISTICS")
         print("-" * 30)
 
-        cursor.execute("SELECT COUNT(*) FROM cidades_rodonaves WHERE distancia_km > 0")
-        valid_distances = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM cidades_rodonaves WHERE distancia_km = 0")
-        zero_distances = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM cidades_rodonaves WHERE distancia_km IS NULL")
-        null_distances = cursor.fetchone()[0]
+        # Single pass over cidades_rodonaves for every distance statistic
+        cursor.execute("""
+        SELECT COUNT(*) FILTER (WHERE distancia_km > 0),
+               COUNT(*) FILTER (WHERE distancia_km = 0),
+               COUNT(*) FILTER (WHERE distancia_km IS NULL),
+               MIN(distancia_km) FILTER (WHERE distancia_km > 0),
+               MAX(distancia_km) FILTER (WHERE distancia_km > 0),
+               AVG(distancia_km) FILTER (WHERE distancia_km > 0)
+        FROM cidades_rodonaves
+        """)
+        (valid_distances, zero_distances, null_distances,
+         min_distance, max_distance, avg_all) = cursor.fetchone()
 
         print(f"Cities with valid distances (> 0): {valid_distances}")
         print(f"Cities with zero distances (filial): {zero_distances}")
@@ -61,19 +80,25 @@ def verify_distances():
         print("\n3. MAJOR CAPITALS VERIFICATION")
         print("-" * 30)
 
-        # Check for capital cities
-        capitals_query = """
+        # Check for capital cities by exact name and state (ASCII case-insensitive)
+        # The NOCASE IN list seeks the ix_cid_nome index that create_db_and_tables maintains
+        capital_placeholders = ", ".join("?" for _ in MAJOR_CAPITALS)
+        pair_placeholders = ", ".join("(?, ?)" for _ in MAJOR_CAPITALS)
+        capitals_query = f"""
         SELECT c.nome, e.sigla, c.distancia_km, c.categoria_tarifa, f.codigo
         FROM cidades_rodonaves c
         JOIN estados e ON c.estado_id = e.id
         JOIN filiais_rodonaves f ON c.filial_atendimento_id = f.id
-        WHERE c.nome LIKE '%São Paulo%' OR c.nome LIKE '%Rio de Janeiro%'
-           OR c.nome LIKE '%Belo Horizonte%' OR c.nome LIKE '%Curitiba%'
-           OR c.nome LIKE '%Porto Alegre%' OR c.nome LIKE '%Florianópolis%'
+        WHERE c.nome COLLATE NOCASE IN ({capital_placeholders})
+          AND (c.nome COLLATE NOCASE, e.sigla) IN (VALUES {pair_placeholders})
         ORDER BY e.sigla, c.nome
         """
 
-        cursor.execute(capitals_query)
+        cursor.execute(
+            capitals_query,
+            [nome for nome, _ in MAJOR_CAPITALS]
+            + [value for pair in MAJOR_CAPITALS for value in pair]
+        )
         capitals = cursor.fetchall()
 
         if capitals:
@@ -82,15 +107,15 @@ def verify_distances():
                 print(f"{city_name}/{state}: {distance_str} (via {filial}) - {category}")
         else:
             # Try alternative search
-            cursor.execute("""
+            cursor.execute(f"""
             SELECT c.nome, e.sigla, c.distancia_km, c.categoria_tarifa, f.codigo
             FROM cidades_rodonaves c
             JOIN estados e ON c.estado_id = e.id
             JOIN filiais_rodonaves f ON c.filial_atendimento_id = f.id
-            WHERE e.sigla IN ('SP', 'RJ', 'MG', 'PR', 'RS', 'SC')
-              AND c.categoria_tarifa = 'CAPITAL'
+            WHERE e.sigla IN ({capital_placeholders})
+              AND c.categoria_tarifa = ?
             ORDER BY e.sigla
-            """)
+            """, [sigla for _, sigla in MAJOR_CAPITALS] + ['CAPITAL'])
 
             capital_cities = cursor.fetchall()
             for city_name, state, distance, category, filial in capital_cities:
@@ -186,14 +211,14 @@ def verify_distances():
         SELECT c.nome, e.sigla, c.distancia_km
         FROM cidades_rodonaves c
         JOIN estados e ON c.estado_id = e.id
-        WHERE c.distancia_km > 2500
+        WHERE c.distancia_km > ?
         ORDER BY c.distancia_km DESC
         LIMIT 5
-        """)
+        """, (HIGH_DISTANCE_KM,))
 
         high_distances = cursor.fetchall()
         if high_distances:
-            print("Cities with very high distances (>2500km):")
+            print(f"Cities with very high distances (>{HIGH_DISTANCE_KM}km):")
             for city, state, distance in high_distances:
                 print(f"  {city}/{state}: {distance}km")
         else:
@@ -204,8 +229,8 @@ def verify_distances():
         SELECT c.nome, e.sigla, c.distancia_km
         FROM cidades_rodonaves c
         JOIN estados e ON c.estado_id = e.id
-        WHERE c.distancia_km < 0
-        """)
+        WHERE c.distancia_km < ?
+        """, (0,))
 
         negative = cursor.fetchall()
         if negative:
@@ -215,14 +240,8 @@ def verify_distances():
         else:
             print("No cities with negative distances found")
 
-        # Overall distance statistics
-        cursor.execute("SELECT AVG(distancia_km) FROM cidades_rodonaves WHERE distancia_km > 0")
-        avg_all = cursor.fetchone()[0]
-
-        cursor.execute("SELECT MIN(distancia_km), MAX(distancia_km) FROM cidades_rodonaves WHERE distancia_km > 0")
-        min_max = cursor.fetchone()
-
-        print(f"Overall distance stats: {min_max[0]:.0f}km - {min_max[1]:.0f}km (avg: {avg_all:.0f}km)")
+        # Overall distance statistics (computed in section 2)
+        print(f"Overall distance stats: {min_distance:.0f}km - {max_distance:.0f}km (avg: {avg_all:.0f}km)")
 
         # 9. Category distribution
         print("\n9. CITY CATEGORIES")
@@ -278,6 +297,8 @@ def verify_distances():
     except Exception as e:
         print(f"Error: {e}")
     finally:
+        # Nothing was written; just release the read snapshot
+        conn.rollback()
         conn.close()
 
     print("\n" + "=" * 60)
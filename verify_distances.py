@@ -4,8 +4,11 @@ Comprehensive verification script for distance data in the Rodonaves freight sys
 Checks all cities, states, and validates distance calculations.
 """
 
+import io
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import and_, bindparam, case, exists, or_, tuple_
 from sqlmodel import Session, select, func
 from typing import Dict, List, Tuple, Optional
 import pandas as pd
@@ -19,9 +22,104 @@ from frete_app.models_extended import (
     TaxaEspecial, CEPEspecial, TabelaTarifaCompleta
 )
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rows buffered at a time while scanning for anomalous distances
+ANOMALY_FETCH_SIZE = 1000
+
+# Rows buffered at a time while streaming the per-state city samples
+SAMPLE_FETCH_SIZE = 1000
+
+# Statements built once at import; capitals are bound per call
+MAJOR_CAPITAL_CITIES = select(CidadeRodonaves).where(
+    tuple_(CidadeRodonaves.nome, CidadeRodonaves.estado_id).in_(
+        bindparam('capitals', expanding=True)
+    )
+)
+
+STATE_DISTANCE_STATS = select(
+    CidadeRodonaves.estado_id,
+    func.count(CidadeRodonaves.id).label('total'),
+    func.sum(case((CidadeRodonaves.distancia_km > 0, 1), else_=0)).label('valid'),
+    func.sum(case((CidadeRodonaves.distancia_km == 0, 1), else_=0)).label('zero'),
+    func.sum(case((CidadeRodonaves.distancia_km.is_(None), 1), else_=0)).label('null')
+).group_by(CidadeRodonaves.estado_id)
+
+_ranked_cities = select(
+    CidadeRodonaves.id,
+    func.row_number().over(
+        partition_by=CidadeRodonaves.estado_id, order_by=CidadeRodonaves.id
+    ).label('rn')
+).subquery()
+
+STATE_CITY_SAMPLES = (
+    select(
+        CidadeRodonaves.estado_id,
+        CidadeRodonaves.nome,
+        CidadeRodonaves.distancia_km,
+        CidadeRodonaves.categoria_tarifa,
+        CidadeRodonaves.filial_atendimento_id
+    )
+    .join(_ranked_cities, _ranked_cities.c.id == CidadeRodonaves.id)
+    .where(_ranked_cities.c.rn <= 5)
+    .order_by(CidadeRodonaves.estado_id, CidadeRodonaves.id)
+    .execution_options(yield_per=SAMPLE_FETCH_SIZE)
+)
+
+_ranked_distances = select(
+    CidadeRodonaves.estado_id,
+    CidadeRodonaves.distancia_km,
+    func.row_number().over(
+        partition_by=CidadeRodonaves.estado_id, order_by=CidadeRodonaves.id
+    ).label('rn')
+).where(CidadeRodonaves.distancia_km > 0).subquery()
+
+# Distance spread of the first 10 positive distances in each of the first 5 states
+STATE_DISTANCE_CONSISTENCY = (
+    select(
+        Estado.sigla,
+        func.min(_ranked_distances.c.distancia_km),
+        func.max(_ranked_distances.c.distancia_km),
+        func.avg(_ranked_distances.c.distancia_km),
+        func.count()
+    )
+    .join(_ranked_distances, _ranked_distances.c.estado_id == Estado.id)
+    .where(_ranked_distances.c.rn <= 10)
+    .where(Estado.id.in_(
+        select(Estado.id).order_by(Estado.id).limit(5).correlate(None)
+    ))
+    .group_by(Estado.id, Estado.sigla)
+    .having(func.count() >= 2)
+    .order_by(Estado.id)
+)
+
+# Very high distances first, then negative ones, each in city id order
+OUT_OF_RANGE_DISTANCES = (
+    select(CidadeRodonaves.nome, Estado.sigla, CidadeRodonaves.distancia_km)
+    .join(Estado)
+    .where(or_(CidadeRodonaves.distancia_km > 2500, CidadeRodonaves.distancia_km < 0))
+    .order_by(CidadeRodonaves.distancia_km < 0, CidadeRodonaves.id)
+    .execution_options(yield_per=ANOMALY_FETCH_SIZE)
+)
+
+FILIAL_CITIES = (
+    select(FilialRodonaves, CidadeRodonaves)
+    .outerjoin(CidadeRodonaves, and_(
+        CidadeRodonaves.nome == FilialRodonaves.cidade,
+        CidadeRodonaves.estado_id == FilialRodonaves.estado_id
+    ))
+    .order_by(FilialRodonaves.id, CidadeRodonaves.id)
+)
+
+
 class DistanceVerificationReport:
     def __init__(self):
         self.session = Session(engine)
+        # Progress lines are buffered and written in one go when the run ends
+        self._log = io.StringIO()
         self.report = {
             'total_states': 0,
             'total_cities': 0,
@@ -37,88 +135,131 @@ class DistanceVerificationReport:
 
     def run_verification(self) -> Dict:
         """Run comprehensive distance data verification"""
-        print("Starting comprehensive distance verification...")
+        print("Starting comprehensive distance verification...", file=self._log)
 
         try:
             self._verify_database_structure()
+            self._load_filiais()
+            self._load_estados()
+            self._load_state_stats()
             self._count_basic_statistics()
-            self._verify_major_capitals()
-            self._sample_state_cities()
-            self._check_distance_consistency()
-            self._verify_filial_distances()
+            self._run_independent_sections()
             self._analyze_anomalies()
 
-            print("Verification completed successfully!")
+            print("Verification completed successfully!", file=self._log)
             return self.report
 
         except Exception as e:
-            print(f"Error during verification: {e}")
+            print(f"Error during verification: {e}", file=self._log)
             self.report['error'] = str(e)
             return self.report
         finally:
             self.session.close()
+            sys.stdout.write(self._log.getvalue())
+            self._log = io.StringIO()
+
+    def _run_independent_sections(self):
+        """
+        Run the read-only sections concurrently, each with its own Session
+
+        Every section writes its own report key (only the filial check appends
+        anomalies), and its progress lines are buffered and printed in the usual
+        order once all sections finish.
+        """
+        sections = (
+            self._verify_major_capitals,
+            self._sample_state_cities,
+            self._check_distance_consistency,
+            self._verify_filial_distances,
+        )
+        outputs = [io.StringIO() for _ in sections]
+
+        def run_section(section, out):
+            with Session(engine) as session:
+                section(session, out)
+
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [
+                executor.submit(run_section, section, out)
+                for section, out in zip(sections, outputs)
+            ]
+
+        for future, out in zip(futures, outputs):
+            self._log.write(out.getvalue())
+            future.result()
 
     def _verify_database_structure(self):
         """Check if all required tables exist with data"""
-        print("Verifying database structure...")
-
-        # Check if tables have data
-        states_count = self.session.exec(select(func.count(Estado.id))).first()
-        cities_count = self.session.exec(select(func.count(CidadeRodonaves.id))).first()
-        filiais_count = self.session.exec(select(func.count(FilialRodonaves.id))).first()
-
-        print(f"   States: {states_count}")
-        print(f"   Cities: {cities_count}")
-        print(f"   Filiais: {filiais_count}")
-
-        if states_count == 0:
+        print("Verifying database structure...", file=self._log)
+
+        # Check if tables have data; EXISTS stops at the first row instead of counting
+        has_states, has_cities, has_filiais = self.session.exec(
+            select(
+                exists(select(Estado.id)),
+                exists(select(CidadeRodonaves.id)),
+                exists(select(FilialRodonaves.id))
+            )
+        ).one()
+
+        if not has_states:
             raise Exception("No states found in database")
-        if cities_count == 0:
+        if not has_cities:
             raise Exception("No cities found in database")
-        if filiais_count == 0:
+        if not has_filiais:
             raise Exception("No filiais found in database")
 
-    def _count_basic_statistics(self):
-        """Count basic statistics about distance data"""
-        print("📈 Counting basic statistics...")
+        print("   States, cities and filiais present", file=self._log)
+
+    def _load_filiais(self):
+        """Keep the (small) filial table in memory, keyed by id"""
+        self.filiais_by_id = {
+            filial.id: filial for filial in self.session.exec(select(FilialRodonaves)).all()
+        }
 
-        # Total counts
-        self.report['total_states'] = self.session.exec(select(func.count(Estado.id))).first()
-        self.report['total_cities'] = self.session.exec(select(func.count(CidadeRodonaves.id))).first()
+    def _load_estados(self):
+        """Keep the states in memory, keyed by sigla and by id"""
+        self.estados_by_sigla = {
+            estado.sigla: estado for estado in self.session.exec(select(Estado)).all()
+        }
+        self.estados_by_id = {estado.id: estado for estado in self.estados_by_sigla.values()}
 
-        # Distance statistics
-        valid_distances = self.session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km > 0)
-        ).first()
+    def _load_state_stats(self):
+        """Aggregate total/valid/zero/null distance counts per estado_id once"""
+        self._state_agg = {
+            estado_id: (total, valid, zero, null)
+            for estado_id, total, valid, zero, null in self.session.exec(STATE_DISTANCE_STATS).all()
+        }
 
-        zero_distances = self.session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km == 0)
-        ).first()
+    def _count_basic_statistics(self):
+        """Count basic statistics about distance data"""
+        print("📈 Counting basic statistics...", file=self._log)
 
-        null_distances = self.session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km.is_(None))
-        ).first()
+        # Total counts, from the preloaded states and per-state aggregate
+        self.report['total_states'] = len(self.estados_by_id)
 
+        state_stats = self._state_agg.values()
+        total_cities = sum(total for total, _, _, _ in state_stats)
+        valid_distances = sum(valid for _, valid, _, _ in state_stats)
+        zero_distances = sum(zero for _, _, zero, _ in state_stats)
+        null_distances = sum(null for _, _, _, null in state_stats)
+        self.report['total_cities'] = total_cities
         self.report['cities_with_valid_distances'] = valid_distances
         self.report['cities_with_zero_distances'] = zero_distances
         self.report['cities_with_null_distances'] = null_distances
 
-        print(f"   Total cities: {self.report['total_cities']}")
-        print(f"   Valid distances (> 0): {valid_distances}")
-        print(f"   Zero distances (filial cities): {zero_distances}")
-        print(f"   Null distances (missing data): {null_distances}")
+        print(f"   Total cities: {self.report['total_cities']}", file=self._log)
+        print(f"   Valid distances (> 0): {valid_distances}", file=self._log)
+        print(f"   Zero distances (filial cities): {zero_distances}", file=self._log)
+        print(f"   Null distances (missing data): {null_distances}", file=self._log)
 
         # Calculate coverage percentage
         coverage = ((valid_distances + zero_distances) / self.report['total_cities']) * 100 if self.report['total_cities'] > 0 else 0
         self.report['distance_coverage_percent'] = round(coverage, 2)
-        print(f"   Distance coverage: {coverage:.2f}%")
+        print(f"   Distance coverage: {coverage:.2f}%", file=self._log)
 
-    def _verify_major_capitals(self):
+    def _verify_major_capitals(self, session: Session, out):
         """Verify distance data for major Brazilian capitals"""
-        print("🏛️  Verifying major capitals...")
+        print("🏛️  Verifying major capitals...", file=out)
 
         major_capitals = [
             ('São Paulo', 'SP'),
@@ -129,38 +270,36 @@ class DistanceVerificationReport:
             ('Florianópolis', 'SC')
         ]
 
+        # One round-trip for every capital, probing (nome, estado_id) pairs directly
+        capital_keys = [
+            (city_name, self.estados_by_sigla[state_abbr].id)
+            for city_name, state_abbr in major_capitals
+            if state_abbr in self.estados_by_sigla
+        ]
+        rows = session.exec(MAJOR_CAPITAL_CITIES, params={'capitals': capital_keys}).all()
+
+        capitals_found = {}
+        for city in rows:
+            capitals_found.setdefault((city.nome, city.estado_id), city)
+
         for city_name, state_abbr in major_capitals:
             try:
-                # Get state
-                state = self.session.exec(
-                    select(Estado).where(Estado.sigla == state_abbr)
-                ).first()
-
-                if not state:
+                if state_abbr not in self.estados_by_sigla:
                     self.report['major_capitals_verification'][f"{city_name}/{state_abbr}"] = {
                         'status': 'ERROR',
                         'message': f'State {state_abbr} not found'
                     }
                     continue
 
-                # Get city
-                city = self.session.exec(
-                    select(CidadeRodonaves)
-                    .where(CidadeRodonaves.nome == city_name)
-                    .where(CidadeRodonaves.estado_id == state.id)
-                ).first()
-
-                if not city:
+                city = capitals_found.get((city_name, self.estados_by_sigla[state_abbr].id))
+                if city is None:
                     self.report['major_capitals_verification'][f"{city_name}/{state_abbr}"] = {
                         'status': 'ERROR',
                         'message': f'City {city_name} not found in {state_abbr}'
                     }
                     continue
 
-                # Get filial info
-                filial = self.session.exec(
-                    select(FilialRodonaves).where(FilialRodonaves.id == city.filial_atendimento_id)
-                ).first()
+                filial = self.filiais_by_id.get(city.filial_atendimento_id)
 
                 verification_data = {
                     'status': 'OK',
@@ -183,7 +322,7 @@ class DistanceVerificationReport:
 
                 self.report['major_capitals_verification'][f"{city_name}/{state_abbr}"] = verification_data
 
-                print(f"   {city_name}/{state_abbr}: {city.distancia_km}km - {verification_data['status']}")
+                print(f"   {city_name}/{state_abbr}: {city.distancia_km}km - {verification_data['status']}", file=out)
 
             except Exception as e:
                 self.report['major_capitals_verification'][f"{city_name}/{state_abbr}"] = {
@@ -191,27 +330,24 @@ class DistanceVerificationReport:
                     'message': str(e)
                 }
 
-    def _sample_state_cities(self):
+    def _sample_state_cities(self, session: Session, out):
         """Check sample cities from each state"""
-        print("🗺️  Sampling cities from each state...")
+        print("🗺️  Sampling cities from each state...", file=out)
 
-        states = self.session.exec(select(Estado)).all()
+        states = self.estados_by_id.values()
+
+        # First 5 cities of every state in one query, fetching only the reported columns
+        samples_by_state = {}
+        for city in session.exec(STATE_CITY_SAMPLES):
+            samples_by_state.setdefault(city.estado_id, []).append(city)
 
         for state in states:
             try:
-                # Get sample of cities from this state (max 5)
-                cities = self.session.exec(
-                    select(CidadeRodonaves)
-                    .where(CidadeRodonaves.estado_id == state.id)
-                    .limit(5)
-                ).all()
+                total, valid, zero, null = self._state_agg.get(state.id, (0, 0, 0, 0))
 
                 state_data = {
                     'state_name': state.nome,
-                    'total_cities': self.session.exec(
-                        select(func.count(CidadeRodonaves.id))
-                        .where(CidadeRodonaves.estado_id == state.id)
-                    ).first(),
+                    'total_cities': total,
                     'sample_cities': [],
                     'avg_distance': 0,
                     'distance_stats': {
@@ -224,10 +360,8 @@ class DistanceVerificationReport:
                 total_distance = 0
                 valid_count = 0
 
-                for city in cities:
-                    filial = self.session.exec(
-                        select(FilialRodonaves).where(FilialRodonaves.id == city.filial_atendimento_id)
-                    ).first()
+                for city in samples_by_state.get(state.id, []):
+                    filial = self.filiais_by_id.get(city.filial_atendimento_id)
 
                     city_info = {
                         'name': city.nome,
@@ -252,100 +386,69 @@ class DistanceVerificationReport:
                 if valid_count > 0:
                     state_data['avg_distance'] = round(total_distance / valid_count, 2)
 
-                # Get full state statistics
-                full_stats = self.session.exec(
-                    select(
-                        func.count(CidadeRodonaves.id).label('total'),
-                        func.count(CidadeRodonaves.distancia_km).filter(CidadeRodonaves.distancia_km > 0).label('valid'),
-                        func.count(CidadeRodonaves.distancia_km).filter(CidadeRodonaves.distancia_km == 0).label('zero'),
-                        func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km.is_(None)).label('null')
-                    )
-                    .where(CidadeRodonaves.estado_id == state.id)
-                ).first()
-
                 state_data['full_stats'] = {
-                    'total': full_stats.total,
-                    'valid': full_stats.valid,
-                    'zero': full_stats.zero,
-                    'null': full_stats.null,
-                    'coverage_percent': round(((full_stats.valid + full_stats.zero) / full_stats.total) * 100, 2) if full_stats.total > 0 else 0
+                    'total': total,
+                    'valid': valid,
+                    'zero': zero,
+                    'null': null,
+                    'coverage_percent': round(((valid + zero) / total) * 100, 2) if total > 0 else 0
                 }
 
                 self.report['state_sample_verification'][state.sigla] = state_data
 
-                print(f"   {state.sigla}: {full_stats.total} cities, {state_data['full_stats']['coverage_percent']}% coverage")
+                print(f"   {state.sigla}: {total} cities, {state_data['full_stats']['coverage_percent']}% coverage", file=out)
 
             except Exception as e:
                 self.report['state_sample_verification'][state.sigla] = {
                     'error': str(e)
                 }
 
-    def _check_distance_consistency(self):
+    def _check_distance_consistency(self, session: Session, out):
         """Check consistency between nearby cities"""
-        print("🧭 Checking distance consistency...")
-
-        # Find cities within same state and compare distances
-        states = self.session.exec(select(Estado).limit(5)).all()  # Check first 5 states for performance
-
-        for state in states:
-            try:
-                cities = self.session.exec(
-                    select(CidadeRodonaves)
-                    .where(CidadeRodonaves.estado_id == state.id)
-                    .where(CidadeRodonaves.distancia_km > 0)
-                    .limit(10)
-                ).all()
-
-                if len(cities) < 2:
-                    continue
-
-                # Check if distances are reasonable within the state
-                distances = [city.distancia_km for city in cities if city.distancia_km]
-                if distances:
-                    min_dist = min(distances)
-                    max_dist = max(distances)
-                    avg_dist = sum(distances) / len(distances)
-
-                    consistency_data = {
-                        'min_distance': min_dist,
-                        'max_distance': max_dist,
-                        'avg_distance': round(avg_dist, 2),
-                        'sample_size': len(distances),
-                        'range': max_dist - min_dist
-                    }
-
-                    # Flag potential issues
-                    issues = []
-                    if max_dist - min_dist > 2000:  # Very large range within state
-                        issues.append(f"Large distance range: {max_dist - min_dist:.0f}km")
-                    if max_dist > 3000:  # Suspicious maximum
-                        issues.append(f"Very high maximum distance: {max_dist:.0f}km")
-
-                    consistency_data['potential_issues'] = issues
-
-                    self.report['distance_consistency_check'][state.sigla] = consistency_data
-
-                    status = "⚠️" if issues else "✅"
-                    print(f"   {state.sigla}: {min_dist:.0f}-{max_dist:.0f}km (avg: {avg_dist:.0f}km) {status}")
-
-            except Exception as e:
-                self.report['distance_consistency_check'][state.sigla] = {'error': str(e)}
-
-    def _verify_filial_distances(self):
+        print("🧭 Checking distance consistency...", file=out)
+
+        # Check the first 5 states for performance; the database does the reduction
+        for sigla, min_dist, max_dist, avg_dist, sample_size in session.exec(
+            STATE_DISTANCE_CONSISTENCY
+        ).all():
+            # Check if distances are reasonable within the state
+            consistency_data = {
+                'min_distance': min_dist,
+                'max_distance': max_dist,
+                'avg_distance': round(avg_dist, 2),
+                'sample_size': sample_size,
+                'range': max_dist - min_dist
+            }
+
+            # Flag potential issues
+            issues = []
+            if max_dist - min_dist > 2000:  # Very large range within state
+                issues.append(f"Large distance range: {max_dist - min_dist:.0f}km")
+            if max_dist > 3000:  # Suspicious maximum
+                issues.append(f"Very high maximum distance: {max_dist:.0f}km")
+
+            consistency_data['potential_issues'] = issues
+
+            self.report['distance_consistency_check'][sigla] = consistency_data
+
+            status = "⚠️" if issues else "✅"
+            print(f"   {sigla}: {min_dist:.0f}-{max_dist:.0f}km (avg: {avg_dist:.0f}km) {status}", file=out)
+
+    def _verify_filial_distances(self, session: Session, out):
         """Verify that filial cities have distance = 0"""
-        print("🏢 Verifying filial distances...")
+        print("🏢 Verifying filial distances...", file=out)
 
-        filiais = self.session.exec(select(FilialRodonaves)).all()
+        # Every filial with the city of the same name in its state, in one query
+        rows = session.exec(FILIAL_CITIES).all()
 
-        for filial in filiais:
-            try:
-                # Find city with same name as filial in same state
-                filial_city = self.session.exec(
-                    select(CidadeRodonaves)
-                    .where(CidadeRodonaves.nome == filial.cidade)
-                    .where(CidadeRodonaves.estado_id == filial.estado_id)
-                ).first()
+        seen_filiais = set()
+        for filial, filial_city in rows:
+            # Only the first matching city counts for each filial
+            if filial.id in seen_filiais:
+                continue
+            seen_filiais.add(filial.id)
 
+            try:
                 if filial_city:
                     verification_data = {
                         'filial_code': filial.codigo,
@@ -365,7 +468,7 @@ class DistanceVerificationReport:
                     self.report['filial_distance_verification'][filial.codigo] = verification_data
 
                     status = "✅" if verification_data['status'] == 'OK' else "⚠️"
-                    print(f"   {filial.codigo} ({filial.cidade}): {filial_city.distancia_km}km {status}")
+                    print(f"   {filial.codigo} ({filial.cidade}): {filial_city.distancia_km}km {status}", file=out)
                 else:
                     self.report['filial_distance_verification'][filial.codigo] = {
                         'status': 'NOT_FOUND',
@@ -380,31 +483,15 @@ class DistanceVerificationReport:
 
     def _analyze_anomalies(self):
         """Find and report distance anomalies"""
-        print("🔍 Analyzing distance anomalies...")
+        print("🔍 Analyzing distance anomalies...", file=self._log)
 
         try:
-            # Cities with very high distances (>2500km)
-            high_distance_cities = self.session.exec(
-                select(CidadeRodonaves, Estado.sigla)
-                .join(Estado)
-                .where(CidadeRodonaves.distancia_km > 2500)
-            ).all()
-
-            for city, state_sigla in high_distance_cities:
+            # Cities with very high (>2500km) or negative distances in one
+            # streamed query; high distances are still reported first
+            for nome, state_sigla, distancia_km in self.session.exec(OUT_OF_RANGE_DISTANCES):
+                label = 'Very high distance' if distancia_km > 0 else 'Negative distance'
                 self.report['anomalies'].append(
-                    f"Very high distance: {city.nome}/{state_sigla} = {city.distancia_km}km"
-                )
-
-            # Cities with negative distances
-            negative_distance_cities = self.session.exec(
-                select(CidadeRodonaves, Estado.sigla)
-                .join(Estado)
-                .where(CidadeRodonaves.distancia_km < 0)
-            ).all()
-
-            for city, state_sigla in negative_distance_cities:
-                self.report['anomalies'].append(
-                    f"Negative distance: {city.nome}/{state_sigla} = {city.distancia_km}km"
+                    f"{label}: {nome}/{state_sigla} = {distancia_km}km"
                 )
 
             # States with very low coverage
@@ -418,72 +505,76 @@ class DistanceVerificationReport:
                     f"States with low distance coverage: {', '.join(states_low_coverage)}"
                 )
 
-            print(f"   Found {len(self.report['anomalies'])} anomalies")
+            print(f"   Found {len(self.report['anomalies'])} anomalies", file=self._log)
 
         except Exception as e:
             self.report['anomalies'].append(f"Error analyzing anomalies: {str(e)}")
 
     def print_summary_report(self):
         """Print a formatted summary of the verification results"""
-        print("\n" + "="*80)
-        print("📋 DISTANCE VERIFICATION SUMMARY REPORT")
-        print("="*80)
+        out = io.StringIO()
+
+        print("\n" + "="*80, file=out)
+        print("📋 DISTANCE VERIFICATION SUMMARY REPORT", file=out)
+        print("="*80, file=out)
 
         # Basic statistics
-        print(f"\n📊 DATABASE OVERVIEW:")
-        print(f"   Total States: {self.report['total_states']}")
-        print(f"   Total Cities: {self.report['total_cities']}")
-        print(f"   Distance Coverage: {self.report.get('distance_coverage_percent', 0)}%")
-        print(f"   Cities with valid distances: {self.report['cities_with_valid_distances']}")
-        print(f"   Cities with zero distances (filial): {self.report['cities_with_zero_distances']}")
-        print(f"   Cities with null distances (missing): {self.report['cities_with_null_distances']}")
+        print(f"\n📊 DATABASE OVERVIEW:", file=out)
+        print(f"   Total States: {self.report['total_states']}", file=out)
+        print(f"   Total Cities: {self.report['total_cities']}", file=out)
+        print(f"   Distance Coverage: {self.report.get('distance_coverage_percent', 0)}%", file=out)
+        print(f"   Cities with valid distances: {self.report['cities_with_valid_distances']}", file=out)
+        print(f"   Cities with zero distances (filial): {self.report['cities_with_zero_distances']}", file=out)
+        print(f"   Cities with null distances (missing): {self.report['cities_with_null_distances']}", file=out)
 
         # Major capitals status
-        print(f"\n🏛️  MAJOR CAPITALS STATUS:")
+        print(f"\n🏛️  MAJOR CAPITALS STATUS:", file=out)
         for capital, data in self.report['major_capitals_verification'].items():
             status_icon = "✅" if data['status'] == 'OK' else "⚠️" if data['status'] == 'WARNING' else "❌"
             distance = f"{data.get('distance_km', 'N/A')}km" if data.get('distance_km') is not None else "No distance"
-            print(f"   {status_icon} {capital}: {distance}")
+            print(f"   {status_icon} {capital}: {distance}", file=out)
             if 'message' in data:
-                print(f"      {data['message']}")
+                print(f"      {data['message']}", file=out)
 
         # State coverage summary
-        print(f"\n🗺️  STATE COVERAGE SUMMARY:")
+        print(f"\n🗺️  STATE COVERAGE SUMMARY:", file=out)
         for state_code, data in self.report['state_sample_verification'].items():
             if 'full_stats' in data:
                 coverage = data['full_stats']['coverage_percent']
                 status_icon = "✅" if coverage >= 90 else "⚠️" if coverage >= 70 else "❌"
-                print(f"   {status_icon} {state_code}: {data['full_stats']['total']} cities, {coverage}% coverage")
+                print(f"   {status_icon} {state_code}: {data['full_stats']['total']} cities, {coverage}% coverage", file=out)
 
         # Filial verification
-        print(f"\n🏢 FILIAL DISTANCE VERIFICATION:")
+        print(f"\n🏢 FILIAL DISTANCE VERIFICATION:", file=out)
         ok_count = sum(1 for data in self.report['filial_distance_verification'].values() if data.get('status') == 'OK')
         total_filiais = len(self.report['filial_distance_verification'])
-        print(f"   {ok_count}/{total_filiais} filials have correct zero distance")
+        print(f"   {ok_count}/{total_filiais} filials have correct zero distance", file=out)
 
         # Anomalies
-        print(f"\n⚠️  ANOMALIES DETECTED:")
+        print(f"\n⚠️  ANOMALIES DETECTED:", file=out)
         if self.report['anomalies']:
             for anomaly in self.report['anomalies'][:10]:  # Show first 10
-                print(f"   • {anomaly}")
+                print(f"   • {anomaly}", file=out)
             if len(self.report['anomalies']) > 10:
-                print(f"   ... and {len(self.report['anomalies']) - 10} more")
+                print(f"   ... and {len(self.report['anomalies']) - 10} more", file=out)
         else:
-            print("   ✅ No major anomalies detected")
+            print("   ✅ No major anomalies detected", file=out)
 
         # Final assessment
-        print(f"\n🎯 FINAL ASSESSMENT:")
+        print(f"\n🎯 FINAL ASSESSMENT:", file=out)
         coverage = self.report.get('distance_coverage_percent', 0)
         if coverage >= 95:
-            print("   ✅ EXCELLENT: Distance data is comprehensive and well-imported")
+            print("   ✅ EXCELLENT: Distance data is comprehensive and well-imported", file=out)
         elif coverage >= 85:
-            print("   ✅ GOOD: Distance data coverage is adequate with minor gaps")
+            print("   ✅ GOOD: Distance data coverage is adequate with minor gaps", file=out)
         elif coverage >= 70:
-            print("   ⚠️  FAIR: Distance data has significant gaps that should be addressed")
+            print("   ⚠️  FAIR: Distance data has significant gaps that should be addressed", file=out)
         else:
-            print("   ❌ POOR: Distance data coverage is insufficient")
+            print("   ❌ POOR: Distance data coverage is insufficient", file=out)
+
+        print("\n" + "="*80, file=out)
 
-        print("\n" + "="*80)
+        sys.stdout.write(out.getvalue())
 
 
 def main():
@@ -496,10 +587,16 @@ def main():
         report = verifier.run_verification()
         verifier.print_summary_report()
 
-        # Save detailed report to file
-        import json
-        with open('distance_verification_report.json', 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+        # Save detailed report to file (orjson serializes in C when installed)
+        if orjson is not None:
+            with open('distance_verification_report.json', 'wb') as f:
+                f.write(orjson.dumps(
+                    report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str
+                ))
+        else:
+            import json
+            with open('distance_verification_report.json', 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False, default=str)
 
         print(f"\n💾 Detailed report saved to: distance_verification_report.json")
 
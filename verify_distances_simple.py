@@ -4,8 +4,12 @@ Comprehensive verification script for distance data in the Rodonaves freight sys
 Checks all cities, states, and validates distance calculations.
 """
 
+import io
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from sqlalchemy import and_, case, tuple_
 from sqlmodel import Session, select, func
 
 # Add the app directory to Python path
@@ -21,191 +25,268 @@ except ImportError as e:
     print("Make sure you're running from the project root directory")
     sys.exit(1)
 
+# Rows buffered at a time for the single-pass listings
+STREAM_FETCH_SIZE = 200
+
+# Statements built once at import and reused on every run
+OVERVIEW_TOTALS = select(
+    select(func.count(Estado.id)).scalar_subquery(),
+    select(func.count(FilialRodonaves.id)).scalar_subquery(),
+    func.count(CidadeRodonaves.id),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km > 0),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km == 0),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km.is_(None)),
+)
+
+MAJOR_CAPITALS = [
+    ('São Paulo', 'SP'),
+    ('Rio de Janeiro', 'RJ'),
+    ('Belo Horizonte', 'MG'),
+    ('Curitiba', 'PR'),
+    ('Porto Alegre', 'RS'),
+    ('Florianópolis', 'SC')
+]
+
+# The outer joins keep a state row even when its capital is missing, so
+# "City not found" can still be told apart
+MAJOR_CAPITAL_ROWS = (
+    select(
+        Estado.sigla,
+        CidadeRodonaves.nome,
+        CidadeRodonaves.distancia_km,
+        CidadeRodonaves.categoria_tarifa,
+        FilialRodonaves.codigo
+    )
+    .select_from(Estado)
+    .outerjoin(
+        CidadeRodonaves,
+        and_(
+            CidadeRodonaves.estado_id == Estado.id,
+            tuple_(CidadeRodonaves.nome, Estado.sigla).in_(MAJOR_CAPITALS)
+        )
+    )
+    .outerjoin(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
+    .where(Estado.sigla.in_([state_abbr for _, state_abbr in MAJOR_CAPITALS]))
+    .order_by(CidadeRodonaves.id)
+)
+
+STATE_COVERAGE_STATS = select(
+    CidadeRodonaves.estado_id,
+    func.count(CidadeRodonaves.id).label('total'),
+    func.sum(
+        case(
+            (CidadeRodonaves.distancia_km > 0, 1),
+            (CidadeRodonaves.distancia_km == 0, 1),
+            else_=0
+        )
+    ).label('with_distance')
+).group_by(CidadeRodonaves.estado_id)
+
+STATES_BY_SIGLA = (
+    select(Estado.id, Estado.sigla, Estado.nome)
+    .order_by(Estado.sigla)
+    .execution_options(yield_per=STREAM_FETCH_SIZE)
+)
+
+# Outer joins keep cities whose filial is missing visible to the filial and
+# anomaly checks, which never joined on it
+CITY_ROWS = (
+    select(
+        CidadeRodonaves.nome,
+        CidadeRodonaves.estado_id,
+        CidadeRodonaves.distancia_km,
+        CidadeRodonaves.categoria_tarifa,
+        Estado.sigla,
+        FilialRodonaves.codigo
+    )
+    .outerjoin(Estado, CidadeRodonaves.estado_id == Estado.id)
+    .outerjoin(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
+    .order_by(CidadeRodonaves.id)
+)
+
+FIRST_FILIAIS = select(FilialRodonaves).order_by(FilialRodonaves.codigo).limit(10)
+
+def _capitals_section(session, out):
+    """Section 3: major capitals with their state, filial and distance"""
+    print("\n3. MAJOR CAPITALS VERIFICATION", file=out)
+    print("-" * 30, file=out)
+
+    # One round-trip for all capitals
+    capital_rows = session.exec(MAJOR_CAPITAL_ROWS)
+
+    found_states = set()
+    capitals_found = {}
+    for row in capital_rows:
+        found_states.add(row.sigla)
+        if row.nome is not None:
+            capitals_found.setdefault((row.nome, row.sigla), row)
+
+    for city_name, state_abbr in MAJOR_CAPITALS:
+        city = capitals_found.get((city_name, state_abbr))
+
+        if city:
+            filial_code = city.codigo if city.codigo else "Unknown"
+            distance_str = f"{city.distancia_km}km" if city.distancia_km is not None else "No distance"
+
+            print(f"{city_name}/{state_abbr}: {distance_str} (via {filial_code}) - {city.categoria_tarifa}", file=out)
+        elif state_abbr in found_states:
+            print(f"{city_name}/{state_abbr}: City not found", file=out)
+        else:
+            print(f"{city_name}/{state_abbr}: State not found", file=out)
+
+
+def _coverage_section(session, out):
+    """Section 4: per-state coverage summary"""
+    print("\n4. STATE COVERAGE SUMMARY", file=out)
+    print("-" * 30, file=out)
+
+    # Per-state totals in one grouped aggregate instead of a query per state
+    stats_by_state = {row.estado_id: row for row in session.exec(STATE_COVERAGE_STATS)}
+
+    states = session.exec(STATES_BY_SIGLA)
+
+    for state in states:
+        state_stats = stats_by_state.get(state.id)
+
+        if state_stats and state_stats.total > 0:
+            coverage_pct = (state_stats.with_distance / state_stats.total) * 100 if state_stats.with_distance else 0
+            print(f"{state.sigla:2} ({state.nome:15}): {state_stats.total:4} cities, {coverage_pct:6.1f}% coverage", file=out)
+
+
+def _city_sections(session, out):
+    """Sections 5-7: filial cities, sample distances and anomalies"""
+    # Sections 5-7 all read the same city/state/filial join; fetch it once
+    # and filter in Python
+    city_rows = session.exec(CITY_ROWS).all()
+
+    # Filial cities verification
+    print("\n5. FILIAL CITIES VERIFICATION", file=out)
+    print("-" * 30, file=out)
+
+    filiais = session.exec(FIRST_FILIAIS).all()  # Show first 10 filiais
+
+    city_map = {}
+    for city in city_rows:
+        city_map.setdefault((city.nome, city.estado_id), city)
+
+    for filial in filiais:
+        filial_city = city_map.get((filial.cidade, filial.estado_id))
+
+        if filial_city:
+            distance = filial_city.distancia_km
+            status = "OK" if distance == 0 else "WARNING"
+            print(f"{filial.codigo:3} ({filial.cidade:15}): {distance}km - {status}", file=out)
+        else:
+            print(f"{filial.codigo:3} ({filial.cidade:15}): City not found", file=out)
+
+    # Sample distances for validation
+    print("\n6. SAMPLE DISTANCES FOR VALIDATION", file=out)
+    print("-" * 30, file=out)
+
+    # Get some cities with distances
+    sample_cities = islice(
+        (city for city in city_rows
+         if city.sigla is not None and city.codigo is not None
+         and city.distancia_km is not None and city.distancia_km > 0),
+        15
+    )
+
+    for city in sample_cities:
+        print(f"{city.nome}/{city.sigla}: {city.distancia_km}km (via {city.codigo}) - {city.categoria_tarifa}", file=out)
+
+    # Anomaly detection
+    print("\n7. ANOMALY DETECTION", file=out)
+    print("-" * 30, file=out)
+
+    located = [
+        city for city in city_rows
+        if city.sigla is not None and city.distancia_km is not None
+    ]
+
+    # Very high distances
+    high_distances = [city for city in located if city.distancia_km > 2500][:5]
+
+    if high_distances:
+        print("Cities with very high distances (>2500km):", file=out)
+        for city in high_distances:
+            print(f"  {city.nome}/{city.sigla}: {city.distancia_km}km", file=out)
+    else:
+        print("No cities with suspiciously high distances found", file=out)
+
+    # Negative distances
+    negative_distances = [city for city in located if city.distancia_km < 0]
+
+    if negative_distances:
+        print("Cities with negative distances:", file=out)
+        for city in negative_distances:
+            print(f"  {city.nome}/{city.sigla}: {city.distancia_km}km", file=out)
+    else:
+        print("No cities with negative distances found", file=out)
+
+
 def verify_distance_data():
     """Verify distance data comprehensively"""
-    print("RODONAVES DISTANCE VERIFICATION REPORT")
-    print("=" * 60)
+    # The report is built in memory and written to stdout in one go
+    out = io.StringIO()
+
+    print("RODONAVES DISTANCE VERIFICATION REPORT", file=out)
+    print("=" * 60, file=out)
 
     session = Session(engine)
 
     try:
         # Basic counts
-        print("\n1. DATABASE OVERVIEW")
-        print("-" * 30)
-
-        total_states = session.exec(select(func.count(Estado.id))).first()
-        total_cities = session.exec(select(func.count(CidadeRodonaves.id))).first()
-        total_filiais = session.exec(select(func.count(FilialRodonaves.id))).first()
-
-        print(f"Total States: {total_states}")
-        print(f"Total Cities: {total_cities}")
-        print(f"Total Filiais: {total_filiais}")
+        print("\n1. DATABASE OVERVIEW", file=out)
+        print("-" * 30, file=out)
+
+        # Overview totals and distance statistics in a single round-trip
+        (
+            total_states,
+            total_filiais,
+            total_cities,
+            valid_distances,
+            zero_distances,
+            null_distances,
+        ) = session.exec(OVERVIEW_TOTALS).one()
+
+        print(f"Total States: {total_states}", file=out)
+        print(f"Total Cities: {total_cities}", file=out)
+        print(f"Total Filiais: {total_filiais}", file=out)
 
         # Distance statistics
-        print("\n2. DISTANCE DATA STATISTICS")
-        print("-" * 30)
+        print("\n2. DISTANCE DATA STATISTICS", file=out)
+        print("-" * 30, file=out)
 
-        valid_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km > 0)
-        ).first()
+        print(f"Cities with valid distances (> 0): {valid_distances}", file=out)
+        print(f"Cities with zero distances (filial): {zero_distances}", file=out)
+        print(f"Cities with null distances (missing): {null_distances}", file=out)
 
-        zero_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km == 0)
-        ).first()
+        if total_cities > 0:
+            coverage = ((valid_distances + zero_distances) / total_cities) * 100
+            print(f"Distance coverage: {coverage:.2f}%", file=out)
 
-        null_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km.is_(None))
-        ).first()
+        # Sections 3-7 only read; run them concurrently, each with its own
+        # Session, and append their buffered output in report order
+        sections = (_capitals_section, _coverage_section, _city_sections)
+        outputs = [io.StringIO() for _ in sections]
 
-        print(f"Cities with valid distances (> 0): {valid_distances}")
-        print(f"Cities with zero distances (filial): {zero_distances}")
-        print(f"Cities with null distances (missing): {null_distances}")
+        def run_section(section, section_out):
+            with Session(engine) as section_session:
+                section(section_session, section_out)
 
-        if total_cities > 0:
-            coverage = ((valid_distances + zero_distances) / total_cities) * 100
-            print(f"Distance coverage: {coverage:.2f}%")
-
-        # Major capitals verification
-        print("\n3. MAJOR CAPITALS VERIFICATION")
-        print("-" * 30)
-
-        major_capitals = [
-            ('São Paulo', 'SP'),
-            ('Rio de Janeiro', 'RJ'),
-            ('Belo Horizonte', 'MG'),
-            ('Curitiba', 'PR'),
-            ('Porto Alegre', 'RS'),
-            ('Florianópolis', 'SC')
-        ]
-
-        for city_name, state_abbr in major_capitals:
-            try:
-                state = session.exec(
-                    select(Estado).where(Estado.sigla == state_abbr)
-                ).first()
-
-                if state:
-                    city = session.exec(
-                        select(CidadeRodonaves)
-                        .where(CidadeRodonaves.nome == city_name)
-                        .where(CidadeRodonaves.estado_id == state.id)
-                    ).first()
-
-                    if city:
-                        filial = session.exec(
-                            select(FilialRodonaves).where(FilialRodonaves.id == city.filial_atendimento_id)
-                        ).first()
-
-                        filial_code = filial.codigo if filial else "Unknown"
-                        distance_str = f"{city.distancia_km}km" if city.distancia_km is not None else "No distance"
-
-                        print(f"{city_name}/{state_abbr}: {distance_str} (via {filial_code}) - {city.categoria_tarifa}")
-                    else:
-                        print(f"{city_name}/{state_abbr}: City not found")
-                else:
-                    print(f"{city_name}/{state_abbr}: State not found")
-            except Exception as e:
-                print(f"{city_name}/{state_abbr}: Error - {e}")
-
-        # State-by-state summary
-        print("\n4. STATE COVERAGE SUMMARY")
-        print("-" * 30)
-
-        states = session.exec(select(Estado).order_by(Estado.sigla)).all()
-
-        for state in states:
-            state_stats = session.exec(
-                select(
-                    func.count(CidadeRodonaves.id).label('total'),
-                    func.sum(
-                        func.case(
-                            (CidadeRodonaves.distancia_km > 0, 1),
-                            (CidadeRodonaves.distancia_km == 0, 1),
-                            else_=0
-                        )
-                    ).label('with_distance')
-                )
-                .where(CidadeRodonaves.estado_id == state.id)
-            ).first()
-
-            if state_stats.total > 0:
-                coverage_pct = (state_stats.with_distance / state_stats.total) * 100 if state_stats.with_distance else 0
-                print(f"{state.sigla:2} ({state.nome:15}): {state_stats.total:4} cities, {coverage_pct:6.1f}% coverage")
-
-        # Filial cities verification
-        print("\n5. FILIAL CITIES VERIFICATION")
-        print("-" * 30)
-
-        filiais = session.exec(select(FilialRodonaves).order_by(FilialRodonaves.codigo)).all()
-
-        for filial in filiais[:10]:  # Show first 10 filiais
-            filial_city = session.exec(
-                select(CidadeRodonaves)
-                .where(CidadeRodonaves.nome == filial.cidade)
-                .where(CidadeRodonaves.estado_id == filial.estado_id)
-            ).first()
-
-            if filial_city:
-                distance = filial_city.distancia_km
-                status = "OK" if distance == 0 else "WARNING"
-                print(f"{filial.codigo:3} ({filial.cidade:15}): {distance}km - {status}")
-            else:
-                print(f"{filial.codigo:3} ({filial.cidade:15}): City not found")
-
-        # Sample distances for validation
-        print("\n6. SAMPLE DISTANCES FOR VALIDATION")
-        print("-" * 30)
-
-        # Get some random cities with distances
-        sample_cities = session.exec(
-            select(CidadeRodonaves, Estado.sigla, FilialRodonaves.codigo)
-            .join(Estado)
-            .join(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
-            .where(CidadeRodonaves.distancia_km > 0)
-            .limit(15)
-        ).all()
-
-        for city, state_sigla, filial_code in sample_cities:
-            print(f"{city.nome}/{state_sigla}: {city.distancia_km}km (via {filial_code}) - {city.categoria_tarifa}")
-
-        # Anomaly detection
-        print("\n7. ANOMALY DETECTION")
-        print("-" * 30)
-
-        # Very high distances
-        high_distances = session.exec(
-            select(CidadeRodonaves, Estado.sigla)
-            .join(Estado)
-            .where(CidadeRodonaves.distancia_km > 2500)
-        ).all()
-
-        if high_distances:
-            print("Cities with very high distances (>2500km):")
-            for city, state_sigla in high_distances[:5]:
-                print(f"  {city.nome}/{state_sigla}: {city.distancia_km}km")
-        else:
-            print("No cities with suspiciously high distances found")
-
-        # Negative distances
-        negative_distances = session.exec(
-            select(CidadeRodonaves, Estado.sigla)
-            .join(Estado)
-            .where(CidadeRodonaves.distancia_km < 0)
-        ).all()
-
-        if negative_distances:
-            print("Cities with negative distances:")
-            for city, state_sigla in negative_distances:
-                print(f"  {city.nome}/{state_sigla}: {city.distancia_km}km")
-        else:
-            print("No cities with negative distances found")
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [
+                executor.submit(run_section, section, section_out)
+                for section, section_out in zip(sections, outputs)
+            ]
+
+        for future, section_out in zip(futures, outputs):
+            out.write(section_out.getvalue())
+            future.result()
 
         # Final assessment
-        print("\n8. FINAL ASSESSMENT")
-        print("-" * 30)
+        print("\n8. FINAL ASSESSMENT", file=out)
+        print("-" * 30, file=out)
 
         if total_cities > 0:
             coverage = ((valid_distances + zero_distances) / total_cities) * 100
@@ -223,21 +304,21 @@ def verify_distance_data():
                 status = "POOR"
                 message = "Distance data coverage is insufficient"
 
-            print(f"Overall Status: {status}")
-            print(f"Assessment: {message}")
-            print(f"Coverage Rate: {coverage:.2f}%")
+            print(f"Overall Status: {status}", file=out)
+            print(f"Assessment: {message}", file=out)
+            print(f"Coverage Rate: {coverage:.2f}%", file=out)
         else:
-            print("No cities found in database")
+            print("No cities found in database", file=out)
 
     except Exception as e:
-        print(f"Error during verification: {e}")
+        print(f"Error during verification: {e}", file=out)
         import traceback
         traceback.print_exc()
     finally:
         session.close()
-
-    print("\n" + "=" * 60)
-    print("VERIFICATION COMPLETE")
+        print("\n" + "=" * 60, file=out)
+        print("VERIFICATION COMPLETE", file=out)
+        sys.stdout.write(out.getvalue())
 
 if __name__ == "__main__":
     verify_distance_data()
\ No newline at end of file
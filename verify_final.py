@@ -3,9 +3,12 @@
 Final verification script for distance data in the Rodonaves freight system.
 """
 
+import io
 import sys
 import os
-from sqlmodel import Session, select, func, text
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import case
+from sqlmodel import Session, select, func, text, and_, or_
 
 # Add the app directory to Python path
 sys.path.append(os.path.dirname(__file__))
@@ -19,213 +22,303 @@ except ImportError as e:
     print(f"Import error: {e}")
     sys.exit(1)
 
-def verify_distance_data():
-    """Verify distance data comprehensively"""
-    print("RODONAVES DISTANCE VERIFICATION REPORT")
-    print("=" * 60)
+# Statements built once at import and reused on every run
+OVERVIEW_TOTALS = select(
+    select(func.count(Estado.id)).scalar_subquery(),
+    select(func.count(FilialRodonaves.id)).scalar_subquery(),
+    func.count(CidadeRodonaves.id),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km > 0),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km == 0),
+    func.count(CidadeRodonaves.id).filter(CidadeRodonaves.distancia_km.is_(None)),
+    func.avg(CidadeRodonaves.distancia_km).filter(CidadeRodonaves.distancia_km > 0),
+)
+
+CAPITALS_TO_FIND = [
+    ('São Paulo', 'SP'),
+    ('Rio de Janeiro', 'RJ'),
+    ('Belo Horizonte', 'MG'),
+    ('Curitiba', 'PR'),
+    ('Porto Alegre', 'RS'),
+    ('Florianópolis', 'SC')
+]
+
+MAJOR_CAPITAL_ROWS = (
+    select(
+        CidadeRodonaves.nome,
+        Estado.sigla,
+        FilialRodonaves.codigo,
+        CidadeRodonaves.distancia_km,
+        CidadeRodonaves.categoria_tarifa
+    )
+    .join(Estado, CidadeRodonaves.estado_id == Estado.id)
+    .join(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
+    .where(or_(*[
+        and_(CidadeRodonaves.nome.ilike(capital), Estado.sigla == state_abbr)
+        for capital, state_abbr in CAPITALS_TO_FIND
+    ]))
+    .order_by(CidadeRodonaves.id)
+)
+
+STATES_BY_SIGLA = select(Estado).order_by(Estado.sigla)
+
+STATE_COVERAGE_STATS = select(
+    CidadeRodonaves.estado_id,
+    func.count(CidadeRodonaves.id).label('total'),
+    func.count(CidadeRodonaves.distancia_km).label('with_distance'),
+    func.sum(
+        case((CidadeRodonaves.distancia_km.is_(None), 1), else_=0)
+    ).label('missing')
+).group_by(CidadeRodonaves.estado_id)
+
+# Outer joins keep cities whose filial is missing visible to the filial and
+# anomaly checks, which never joined on it
+CITY_ROWS = (
+    select(
+        CidadeRodonaves.nome,
+        CidadeRodonaves.estado_id,
+        CidadeRodonaves.distancia_km,
+        CidadeRodonaves.categoria_tarifa,
+        Estado.sigla,
+        FilialRodonaves.codigo
+    )
+    .outerjoin(Estado, CidadeRodonaves.estado_id == Estado.id)
+    .outerjoin(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
+    .order_by(CidadeRodonaves.id)
+)
+
+SAMPLE_FILIAIS = select(FilialRodonaves).limit(10)
+
+# Ranges for the first 5 states by sigla, the same ones section 7 lists
+STATE_DISTANCE_RANGES = (
+    select(
+        CidadeRodonaves.estado_id,
+        func.min(CidadeRodonaves.distancia_km).label('min_dist'),
+        func.max(CidadeRodonaves.distancia_km).label('max_dist'),
+        func.avg(CidadeRodonaves.distancia_km).label('avg_dist')
+    )
+    .where(CidadeRodonaves.estado_id.in_(
+        select(Estado.id).order_by(Estado.sigla).limit(5)
+    ))
+    .where(CidadeRodonaves.distancia_km > 0)
+    .group_by(CidadeRodonaves.estado_id)
+)
+
+def _capitals_section(session, out):
+    """Section 3: major capitals, matched case-insensitively in one query"""
+    print("\n3. MAJOR CAPITALS VERIFICATION", file=out)
+    print("-" * 30, file=out)
+
+    capital_rows = session.exec(MAJOR_CAPITAL_ROWS)
+
+    # ilike already ignores case, so match rows back on the lowered name
+    capitals_found = {}
+    for row in capital_rows:
+        capitals_found.setdefault((row.nome.lower(), row.sigla), row)
+
+    for capital, state_abbr in CAPITALS_TO_FIND:
+        city = capitals_found.get((capital.lower(), state_abbr))
+
+        if city:
+            distance_str = f"{city.distancia_km}km" if city.distancia_km is not None else "No distance"
+            print(f"{city.nome}/{city.sigla}: {distance_str} (via {city.codigo}) - {city.categoria_tarifa}", file=out)
+        else:
+            print(f"{capital}: Not found", file=out)
 
-    session = Session(engine)
 
-    try:
-        # 1. Basic Overview
-        print("\n1. DATABASE OVERVIEW")
-        print("-" * 30)
+def _coverage_section(session, out, states):
+    """Section 4: per-state coverage; the aggregate is reused by section 8"""
+    print("\n4. STATE COVERAGE SUMMARY", file=out)
+    print("-" * 30, file=out)
 
-        total_states = session.exec(select(func.count(Estado.id))).first()
-        total_cities = session.exec(select(func.count(CidadeRodonaves.id))).first()
-        total_filiais = session.exec(select(func.count(FilialRodonaves.id))).first()
+    # One grouped aggregate feeds both the coverage table and the missing-data check
+    stats_by_state = {row.estado_id: row for row in session.exec(STATE_COVERAGE_STATS)}
 
-        print(f"Total States: {total_states}")
-        print(f"Total Cities: {total_cities}")
-        print(f"Total Filiais: {total_filiais}")
+    for state in states:
+        state_stats = stats_by_state.get(state.id)
 
-        # 2. Distance Statistics
-        print("\n2. DISTANCE DATA STATISTICS")
-        print("-" * 30)
+        if state_stats and state_stats.total > 0:
+            coverage_pct = (state_stats.with_distance / state_stats.total) * 100
+            print(f"{state.sigla:2} ({state.nome:15}): {state_stats.total:4} cities, {coverage_pct:6.1f}% coverage", file=out)
 
-        valid_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km > 0)
-        ).first()
+    return stats_by_state
 
-        zero_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km == 0)
-        ).first()
 
-        null_distances = session.exec(
-            select(func.count(CidadeRodonaves.id))
-            .where(CidadeRodonaves.distancia_km.is_(None))
-        ).first()
+def _samples_and_filiais_section(session, out, states):
+    """Sections 5 and 6: per-state samples and filial cities from one joined fetch"""
+    # Sections 5, 6 and 8 read the same city/state/filial join; fetch it once
+    # and filter in Python
+    city_rows = session.exec(CITY_ROWS).all()
 
-        print(f"Cities with valid distances (> 0): {valid_distances}")
-        print(f"Cities with zero distances (filial): {zero_distances}")
-        print(f"Cities with null distances (missing): {null_distances}")
+    # 5. Sample distances from different states
+    print("\n5. SAMPLE DISTANCES BY STATE", file=out)
+    print("-" * 30, file=out)
 
-        if total_cities > 0:
-            coverage = ((valid_distances + zero_distances) / total_cities) * 100
-            print(f"Distance coverage: {coverage:.2f}%")
+    # First city with a positive distance in each state
+    samples_by_state = {}
+    for city in city_rows:
+        if city.codigo is not None and city.distancia_km is not None and city.distancia_km > 0:
+            samples_by_state.setdefault(city.estado_id, city)
 
-        # 3. Major Capitals - let's search by pattern
-        print("\n3. MAJOR CAPITALS VERIFICATION")
-        print("-" * 30)
+    for state in states[:8]:  # First 8 states
+        sample_city = samples_by_state.get(state.id)
 
-        capitals_to_find = ['São Paulo', 'Rio de Janeiro', 'Belo Horizonte', 'Curitiba', 'Porto Alegre', 'Florianópolis']
+        if sample_city:
+            print(f"{state.sigla} - {sample_city.nome}: {sample_city.distancia_km}km (via {sample_city.codigo}) - {sample_city.categoria_tarifa}", file=out)
 
-        for capital in capitals_to_find:
-            # Try different variations of the name
-            variations = [capital, capital.upper(), capital.lower()]
-            found = False
+    # 6. Filial verification
+    print("\n6. FILIAL CITIES VERIFICATION (Sample)", file=out)
+    print("-" * 30, file=out)
 
-            for variation in variations:
-                cities = session.exec(
-                    select(CidadeRodonaves, Estado.sigla, FilialRodonaves.codigo)
-                    .join(Estado)
-                    .join(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
-                    .where(CidadeRodonaves.nome.like(f'%{variation}%'))
-                ).all()
+    filiais = session.exec(SAMPLE_FILIAIS).all()
 
-                if cities:
-                    for city, state_sigla, filial_code in cities[:1]:  # Show first match
-                        distance_str = f"{city.distancia_km}km" if city.distancia_km is not None else "No distance"
-                        print(f"{city.nome}/{state_sigla}: {distance_str} (via {filial_code}) - {city.categoria_tarifa}")
-                        found = True
-                        break
+    # Find the city with the same name as each filial
+    city_map = {}
+    for city in city_rows:
+        city_map.setdefault((city.nome, city.estado_id), city)
 
-            if not found:
-                print(f"{capital}: Not found")
+    for filial in filiais:
+        filial_city = city_map.get((filial.cidade, filial.estado_id))
 
-        # 4. State Coverage
-        print("\n4. STATE COVERAGE SUMMARY")
-        print("-" * 30)
+        if filial_city:
+            distance = filial_city.distancia_km
+            status = "OK" if distance == 0 else "WARNING"
+            print(f"{filial.codigo:3} ({filial.cidade:15}): {distance}km - {status}", file=out)
+        else:
+            print(f"{filial.codigo:3} ({filial.cidade:15}): City not found in database", file=out)
 
-        states = session.exec(select(Estado).order_by(Estado.sigla)).all()
+    return city_rows
 
-        for state in states:
-            # Simple count queries
-            total_cities_in_state = session.exec(
-                select(func.count(CidadeRodonaves.id))
-                .where(CidadeRodonaves.estado_id == state.id)
-            ).first()
-
-            cities_with_distance = session.exec(
-                select(func.count(CidadeRodonaves.id))
-                .where(CidadeRodonaves.estado_id == state.id)
-                .where(CidadeRodonaves.distancia_km.is_not(None))
-            ).first()
-
-            if total_cities_in_state > 0:
-                coverage_pct = (cities_with_distance / total_cities_in_state) * 100
-                print(f"{state.sigla:2} ({state.nome:15}): {total_cities_in_state:4} cities, {coverage_pct:6.1f}% coverage")
-
-        # 5. Sample distances from different states
-        print("\n5. SAMPLE DISTANCES BY STATE")
-        print("-" * 30)
-
-        for state in states[:8]:  # First 8 states
-            sample_city = session.exec(
-                select(CidadeRodonaves, FilialRodonaves.codigo)
-                .join(FilialRodonaves, CidadeRodonaves.filial_atendimento_id == FilialRodonaves.id)
-                .where(CidadeRodonaves.estado_id == state.id)
-                .where(CidadeRodonaves.distancia_km > 0)
-                .limit(1)
-            ).first()
-
-            if sample_city:
-                city, filial_code = sample_city
-                print(f"{state.sigla} - {city.nome}: {city.distancia_km}km (via {filial_code}) - {city.categoria_tarifa}")
-
-        # 6. Filial verification
-        print("\n6. FILIAL CITIES VERIFICATION (Sample)")
-        print("-" * 30)
-
-        filiais = session.exec(select(FilialRodonaves).limit(10)).all()
-
-        for filial in filiais:
-            # Find city with same name as filial
-            filial_city = session.exec(
-                select(CidadeRodonaves)
-                .where(CidadeRodonaves.nome == filial.cidade)
-                .where(CidadeRodonaves.estado_id == filial.estado_id)
-            ).first()
-
-            if filial_city:
-                distance = filial_city.distancia_km
-                status = "OK" if distance == 0 else "WARNING"
-                print(f"{filial.codigo:3} ({filial.cidade:15}): {distance}km - {status}")
-            else:
-                print(f"{filial.codigo:3} ({filial.cidade:15}): City not found in database")
-
-        # 7. Distance ranges by state
-        print("\n7. DISTANCE RANGES BY STATE")
-        print("-" * 30)
-
-        for state in states[:5]:  # First 5 states
-            result = session.exec(
-                select(
-                    func.min(CidadeRodonaves.distancia_km),
-                    func.max(CidadeRodonaves.distancia_km),
-                    func.avg(CidadeRodonaves.distancia_km)
-                )
-                .where(CidadeRodonaves.estado_id == state.id)
-                .where(CidadeRodonaves.distancia_km > 0)
-            ).first()
-
-            if result and result[0] is not None:
-                min_dist, max_dist, avg_dist = result
-                print(f"{state.sigla}: {min_dist:.0f}km - {max_dist:.0f}km (avg: {avg_dist:.0f}km)")
+
+def _ranges_section(session, out, states):
+    """Section 7: distance ranges for the first states"""
+    print("\n7. DISTANCE RANGES BY STATE", file=out)
+    print("-" * 30, file=out)
+
+    ranges_by_state = {row.estado_id: row for row in session.exec(STATE_DISTANCE_RANGES)}
+
+    for state in states[:5]:  # First 5 states
+        result = ranges_by_state.get(state.id)
+
+        if result:
+            print(f"{state.sigla}: {result.min_dist:.0f}km - {result.max_dist:.0f}km (avg: {result.avg_dist:.0f}km)", file=out)
+
+
+def verify_distance_data():
+    """Verify distance data comprehensively"""
+    # The report is built in memory and written to stdout in one go
+    out = io.StringIO()
+
+    print("RODONAVES DISTANCE VERIFICATION REPORT", file=out)
+    print("=" * 60, file=out)
+
+    session = Session(engine)
+
+    try:
+        # 1. Basic Overview
+        print("\n1. DATABASE OVERVIEW", file=out)
+        print("-" * 30, file=out)
+
+        # Overview totals and distance statistics in a single round-trip
+        (
+            total_states,
+            total_filiais,
+            total_cities,
+            valid_distances,
+            zero_distances,
+            null_distances,
+            avg_distance_all,
+        ) = session.exec(OVERVIEW_TOTALS).one()
+
+        print(f"Total States: {total_states}", file=out)
+        print(f"Total Cities: {total_cities}", file=out)
+        print(f"Total Filiais: {total_filiais}", file=out)
+
+        # 2. Distance Statistics
+        print("\n2. DISTANCE DATA STATISTICS", file=out)
+        print("-" * 30, file=out)
+
+        print(f"Cities with valid distances (> 0): {valid_distances}", file=out)
+        print(f"Cities with zero distances (filial): {zero_distances}", file=out)
+        print(f"Cities with null distances (missing): {null_distances}", file=out)
+
+        if total_cities > 0:
+            coverage = ((valid_distances + zero_distances) / total_cities) * 100
+            print(f"Distance coverage: {coverage:.2f}%", file=out)
+
+        # Sections 3-7 only read; run them concurrently, each with its own
+        # Session, and append their buffered output in report order
+        states = session.exec(STATES_BY_SIGLA).all()
+
+        sections = (
+            (_capitals_section, ()),
+            (_coverage_section, (states,)),
+            (_samples_and_filiais_section, (states,)),
+            (_ranges_section, (states,)),
+        )
+        outputs = [io.StringIO() for _ in sections]
+
+        def run_section(section, section_out, args):
+            with Session(engine) as section_session:
+                return section(section_session, section_out, *args)
+
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [
+                executor.submit(run_section, section, section_out, args)
+                for (section, args), section_out in zip(sections, outputs)
+            ]
+
+        results = []
+        for future, section_out in zip(futures, outputs):
+            out.write(section_out.getvalue())
+            results.append(future.result())
+
+        _, stats_by_state, city_rows, _ = results
 
         # 8. Anomaly detection
-        print("\n8. ANOMALY DETECTION")
-        print("-" * 30)
+        print("\n8. ANOMALY DETECTION", file=out)
+        print("-" * 30, file=out)
 
         # Very high distances
-        high_distances = session.exec(
-            select(CidadeRodonaves.nome, Estado.sigla, CidadeRodonaves.distancia_km)
-            .join(Estado)
-            .where(CidadeRodonaves.distancia_km > 2500)
-            .limit(5)
-        ).all()
+        high_distances = [
+            city for city in city_rows
+            if city.sigla is not None and city.distancia_km is not None and city.distancia_km > 2500
+        ][:5]
 
         if high_distances:
-            print("Cities with very high distances (>2500km):")
-            for city_name, state_sigla, distance in high_distances:
-                print(f"  {city_name}/{state_sigla}: {distance}km")
+            print("Cities with very high distances (>2500km):", file=out)
+            for city in high_distances:
+                print(f"  {city.nome}/{city.sigla}: {city.distancia_km}km", file=out)
         else:
-            print("No cities with suspiciously high distances found")
+            print("No cities with suspiciously high distances found", file=out)
 
         # Check for missing distance data
         states_with_missing = []
         for state in states:
-            missing_count = session.exec(
-                select(func.count(CidadeRodonaves.id))
-                .where(CidadeRodonaves.estado_id == state.id)
-                .where(CidadeRodonaves.distancia_km.is_(None))
-            ).first()
+            state_stats = stats_by_state.get(state.id)
 
-            if missing_count > 0:
-                states_with_missing.append(f"{state.sigla}: {missing_count}")
+            if state_stats and state_stats.missing > 0:
+                states_with_missing.append(f"{state.sigla}: {state_stats.missing}")
 
         if states_with_missing:
-            print("States with missing distance data:")
+            print("States with missing distance data:", file=out)
             for state_info in states_with_missing:
-                print(f"  {state_info}")
+                print(f"  {state_info}", file=out)
         else:
-            print("All states have complete distance data")
+            print("All states have complete distance data", file=out)
 
         # 9. Final Assessment
-        print("\n9. FINAL ASSESSMENT")
-        print("-" * 30)
+        print("\n9. FINAL ASSESSMENT", file=out)
+        print("-" * 30, file=out)
 
         if total_cities > 0:
             coverage = ((valid_distances + zero_distances) / total_cities) * 100
 
-            print(f"Total cities in database: {total_cities}")
-            print(f"Cities with distance data: {valid_distances + zero_distances}")
-            print(f"Coverage rate: {coverage:.2f}%")
-            print(f"Valid distances (> 0): {valid_distances}")
-            print(f"Zero distances (filial cities): {zero_distances}")
-            print(f"Null/missing distances: {null_distances}")
+            print(f"Total cities in database: {total_cities}", file=out)
+            print(f"Cities with distance data: {valid_distances + zero_distances}", file=out)
+            print(f"Coverage rate: {coverage:.2f}%", file=out)
+            print(f"Valid distances (> 0): {valid_distances}", file=out)
+            print(f"Zero distances (filial cities): {zero_distances}", file=out)
+            print(f"Null/missing distances: {null_distances}", file=out)
 
             if coverage >= 99:
                 status = "EXCELLENT"
@@ -243,32 +336,26 @@ def verify_distance_data():
                 status = "POOR"
                 message = "Distance data coverage is insufficient"
 
-            print(f"\nOverall Status: {status}")
-            print(f"Assessment: {message}")
+            print(f"\nOverall Status: {status}", file=out)
+            print(f"Assessment: {message}", file=out)
 
             # Check if distances are realistic (local filial-to-city, not total route)
-            if valid_distances > 0:
-                avg_distance_all = session.exec(
-                    select(func.avg(CidadeRodonaves.distancia_km))
-                    .where(CidadeRodonaves.distancia_km > 0)
-                ).first()
-
-                if avg_distance_all:
-                    print(f"Average distance across all cities: {avg_distance_all:.0f}km")
-                    if avg_distance_all < 500:
-                        print("✓ Average distance suggests local filial-to-city distances")
-                    else:
-                        print("⚠ Average distance might indicate total route distances")
+            if avg_distance_all:
+                print(f"Average distance across all cities: {avg_distance_all:.0f}km", file=out)
+                if avg_distance_all < 500:
+                    print("✓ Average distance suggests local filial-to-city distances", file=out)
+                else:
+                    print("⚠ Average distance might indicate total route distances", file=out)
 
     except Exception as e:
-        print(f"Error during verification: {e}")
+        print(f"Error during verification: {e}", file=out)
         import traceback
         traceback.print_exc()
     finally:
         session.close()
-
-    print("\n" + "=" * 60)
-    print("VERIFICATION COMPLETE")
+        print("\n" + "=" * 60, file=out)
+        print("VERIFICATION COMPLETE", file=out)
+        sys.stdout.write(out.getvalue())
 
 if __name__ == "__main__":
     verify_distance_data()
\ No newline at end of file
@@ -2,17 +2,99 @@
 VIEWS CORRIGIDAS PARA USAR TABELA DESTINO
 """
 
+import time
+from functools import lru_cache
+from html import escape
+
 from fastapi import APIRouter, Query
 from fastapi.responses import HTMLResponse
-from sqlmodel import Session, select, and_
+from sqlmodel import Session, select, and_, func
 
 from .db import engine
 from .models import Destino
 from .models_extended import Estado
 from .fasthtml import *
 
+try:
+    from cachetools.func import ttl_cache
+except ImportError:
+    ttl_cache = None
+
 router = APIRouter()
 
+# Sugestões repetem muito entre teclas e usuários; guardar por pouco tempo
+AUTOCOMPLETE_CACHE_SIZE = 1024
+AUTOCOMPLETE_CACHE_TTL = 60  # segundos
+
+# Um único handler no container lê os data-* da sugestão clicada
+SUGESTAO_ONCLICK = (
+    "var s = event.target.closest('.cidade-suggestion'); if (!s) return; "
+    "document.getElementById('cidade_busca').value = s.dataset.cidade; "
+    "document.getElementById('cidade_id').value = s.dataset.cidadeId; "
+    "document.getElementById('cidade-suggestions').innerHTML = '';"
+)
+
+# Marcação montada uma vez na importação; por tecla resta só o str.format
+SUGESTAO_TMPL = div(
+    {"class": "cidade-suggestion", "data-cidade": "{cidade}", "data-cidade-id": "{id}",
+     "style": "cursor: pointer; padding: 5px; border-bottom: 1px solid #eee;"},
+    strong({}, "{cidade}"),
+    span({"style": "color: #666; margin-left: 10px;"}, "({categoria})")
+)
+SUGESTOES_TMPL = div(
+    {"onclick": SUGESTAO_ONCLICK,
+     "style": "background: white; border: 1px solid #ccc; max-height: 200px; overflow-y: auto;"},
+    "{itens}"
+)
+
+
+def _escapar_like(texto: str) -> str:
+    """Escapa os curingas do LIKE: %, _ e \\ digitados valem literalmente"""
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _buscar_destinos(estado: str, q: str) -> tuple:
+    """Busca até 10 destinos como tuplas (id, cidade, categoria)"""
+    with Session(engine) as session:
+        # Buscar cidades na tabela Destino (onde estão as 4044 cidades!)
+        # Primeiro os nomes que começam com q: sem curinga à esquerda, o
+        # PostgreSQL lê só a faixa do índice (uf, lower(cidade)) graças ao
+        # text_pattern_ops. O SQLite nunca usa índice de expressão em LIKE
+        # e aproveita apenas a parte uf do índice
+        cidade_lower = func.lower(Destino.cidade)
+        q_like = _escapar_like(q)
+        prefixo = cidade_lower.like(func.lower(f"{q_like}%"), escape="\\")
+        destinos_uf = select(Destino.id, Destino.cidade, Destino.categoria).where(Destino.uf == estado)
+        cidades = session.exec(destinos_uf.where(prefixo).order_by(cidade_lower).limit(10)).all()
+
+        # Com menos de 10 prefixos, completar com o início de outras palavras;
+        # o curinga à esquerda percorre todas as cidades da UF
+        if len(cidades) < 10:
+            cidades += session.exec(
+                destinos_uf.where(
+                    cidade_lower.like(func.lower(f"% {q_like}%"), escape="\\"),
+                    ~prefixo
+                ).order_by(cidade_lower).limit(10 - len(cidades))
+            ).all()
+
+        # Tuplas simples: nada de instâncias ORM presas a uma sessão fechada
+        return tuple(tuple(cidade) for cidade in cidades)
+
+
+if ttl_cache is not None:
+    _autocomplete_lookup = ttl_cache(
+        maxsize=AUTOCOMPLETE_CACHE_SIZE, ttl=AUTOCOMPLETE_CACHE_TTL
+    )(_buscar_destinos)
+else:
+    @lru_cache(maxsize=AUTOCOMPLETE_CACHE_SIZE)
+    def _buscar_destinos_janela(estado: str, q: str, janela: int) -> tuple:
+        return _buscar_destinos(estado, q)
+
+    def _autocomplete_lookup(estado: str, q: str) -> tuple:
+        # Sem cachetools: a janela de tempo na chave faz as entradas expirarem
+        return _buscar_destinos_janela(estado, q, int(time.monotonic() // AUTOCOMPLETE_CACHE_TTL))
+
+
 @router.get("/extended/autocomplete", response_class=HTMLResponse)
 async def autocomplete_cidades(
     estado: str,
@@ -23,54 +105,31 @@ async def autocomplete_cidades(
     if len(q) < 2:
         return ""
 
-    with Session(engine) as session:
-        try:
-            # Normalizar estado
-            estado_normalizado = estado.strip().upper()
-
-            # Buscar cidades na tabela Destino (onde estão as 4044 cidades!)
-            cidades = session.exec(
-                select(Destino).where(
-                    and_(
-                        Destino.uf == estado_normalizado,
-                        Destino.cidade.ilike(f"{q}%")
-                    )
-                ).limit(10)
-            ).all()
+    try:
+        # Normalizar estado
+        estado_normalizado = estado.strip().upper()
+
+        # UF malformada nunca casa com nada: responder sem ir ao banco
+        if len(estado_normalizado) != 2 or not estado_normalizado.isalpha():
+            return ""
+
+        # A busca já compara em minúsculas: "Sao", "sao" e "SAO" dividem a entrada do cache
+        q_lower = q.lower()
+        cidades = _autocomplete_lookup(estado_normalizado, q_lower)
+
+        if not cidades:
+            return div({}, "Nenhuma cidade encontrada")
+
+        # Gerar sugestões HTML; escape() cobre tanto atributos quanto texto
+        items = "".join(
+            SUGESTAO_TMPL.format(id=cidade_id, cidade=escape(nome), categoria=escape(categoria))
+            for cidade_id, nome, categoria in cidades
+        )
+
+        return SUGESTOES_TMPL.format(itens=items)
 
-            # Se não encontrou, busca mais flexível
-            if not cidades:
-                cidades = session.exec(
-                    select(Destino).where(
-                        and_(
-                            Destino.uf == estado_normalizado,
-                            Destino.cidade.ilike(f"%{q}%")
-                        )
-                    ).limit(10)
-                ).all()
-
-            if not cidades:
-                return div({}, "Nenhuma cidade encontrada")
-
-            # Gerar sugestões HTML
-            items = []
-            for cidade in cidades:
-                # JavaScript onclick
-                onclick = f"document.getElementById('cidade_busca').value='{cidade.cidade}'; "
-                onclick += f"document.getElementById('cidade_id').value='{cidade.id}'; "
-                onclick += "document.getElementById('cidade-suggestions').innerHTML='';"
-
-                items.append(
-                    div({"onclick": onclick, "style": "cursor: pointer; padding: 5px; border-bottom: 1px solid #eee;"},
-                        strong({}, cidade.cidade),
-                        span({"style": "color: #666; margin-left: 10px;"}, f"({cidade.categoria})")
-                    )
-                )
-
-            return div({"style": "background: white; border: 1px solid #ccc; max-height: 200px; overflow-y: auto;"}, *items)
-
-        except Exception as e:
-            return div({}, f"Erro: {str(e)}")
+    except Exception as e:
+        return div({}, f"Erro: {escape(str(e))}")
 
 
 # Teste da função
@@ -80,28 +139,30 @@ def test_autocomplete():
 
     with Session(engine) as session:
         # Contar destinos
-        total_destinos = len(session.exec(select(Destino)).all())
+        total_destinos = session.exec(select(func.count()).select_from(Destino)).one()
         print(f"Total de destinos: {total_destinos}")
 
         # Testar busca por SP
         sp_cidades = session.exec(
-            select(Destino).where(Destino.uf == "SP").limit(5)
+            select(Destino.cidade, Destino.categoria).where(Destino.uf == "SP").limit(5)
         ).all()
 
         print(f"Primeiras 5 cidades de SP:")
-        for cidade in sp_cidades:
-            print(f"  - {cidade.cidade} ({cidade.categoria})")
+        for cidade, categoria in sp_cidades:
+            print(f"  - {cidade} ({categoria})")
 
         # Testar busca específica
+        filtro = and_(Destino.uf == "SP", Destino.cidade.ilike("SAO%"))
+        total_sao = session.exec(
+            select(func.count()).select_from(Destino).where(filtro)
+        ).one()
         sao_paulo = session.exec(
-            select(Destino).where(
-                and_(Destino.uf == "SP", Destino.cidade.ilike("SAO%"))
-            )
+            select(Destino.cidade).where(filtro).limit(3)
         ).all()
 
-        print(f"Cidades que começam com 'SAO' em SP: {len(sao_paulo)}")
-        for cidade in sao_paulo[:3]:
-            print(f"  - {cidade.cidade}")
+        print(f"Cidades que começam com 'SAO' em SP: {total_sao}")
+        for cidade in sao_paulo:
+            print(f"  - {cidade}")
 
 if __name__ == "__main__":
     test_autocomplete()
\ No newline at end of file